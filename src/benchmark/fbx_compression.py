@@ -0,0 +1,84 @@
+'''
+Compares the write-time and size of .fbx files with and without array compression, see the 'Array Compression'
+FBX setting of the MwmBuilder node. Runs with any Python that has NumPy, Blender is not needed:
+
+    python src/benchmark/fbx_compression.py --quads 10000 100000 1000000 --repeat 3
+
+The meshes are subdivided planes with a bit of noise, which compress about as well as real models.
+Whether MwmBuilder and Havok accept a file can only be checked by exporting a block with the setting.
+'''
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python', 'medieval_engineers'))
+import fbx_writer
+
+MODES = (('FAST', True), ('NONE', False))
+
+def grid(quads: int, uvLayers: int=2) -> dict:
+    '''A geometry like fbx_fast._mesh() returns for a subdivided plane of about the given number of quads.'''
+    side = max(1, int(round(quads ** 0.5)))
+    rng = np.random.RandomState(side)
+    x, y = np.meshgrid(np.arange(side + 1, dtype=np.float64), np.arange(side + 1, dtype=np.float64))
+    vertices = np.stack((x.ravel(), y.ravel(), rng.normal(0.0, 0.01, x.size)), axis=1)
+
+    corner = (np.arange(side)[None, :] + np.arange(side)[:, None] * (side + 1)).ravel()
+    polygons = np.stack((corner, corner + 1, corner + side + 2, corner + side + 1), axis=1).astype(np.int32)
+    vertexIndices = polygons.ravel()
+    polygonVertices = polygons.copy()
+    polygonVertices[:, 3] ^= -1
+
+    normals = np.tile((0.0, 0.0, 1.0), (len(vertexIndices), 1)) + rng.normal(0.0, 0.001, (len(vertexIndices), 3))
+    uvs = vertices[:, :2] / side
+    return {
+        'uuid': 1,
+        'name': 'Grid',
+        'vertices': vertices,
+        'polygonVertices': polygonVertices.ravel(),
+        'edges': np.arange(len(vertexIndices) // 2, dtype=np.int32),
+        'normals': normals,
+        'uvLayers': [("UVMap%d" % i, uvs, vertexIndices) for i in range(uvLayers)],
+        'nbrMaterials': 1,
+        'materials': None,
+    }
+
+def file(filepath: str, geom: dict, compress: bool) -> dict:
+    root = fbx_writer.Element(b"")
+    fbx_writer.element(root, b"Objects")
+    return {
+        'filepath': filepath,
+        'version': 7400,
+        'root': fbx_writer.plain(root),
+        'geometries': [geom],
+        'compressArrays': compress,
+    }
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='fbx_compression.py', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--quads', type=int, nargs='+', default=[10000, 100000, 1000000], help="sizes of the meshes")
+    parser.add_argument('--repeat', type=int, default=3, help="writes per mesh and mode, the median is reported")
+    args = parser.parse_args(argv)
+
+    print("%10s  %-4s  %10s  %10s  %6s" % ("quads", "mode", "write ms", "size KiB", "ratio"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for quads in args.quads:
+            geom = grid(quads)
+            sizes = {}
+            for mode, compress in MODES:
+                filepath = os.path.join(tmp, "%d-%s.fbx" % (quads, mode))
+                times = []
+                for _ in range(max(1, args.repeat)):
+                    start = time.perf_counter()
+                    fbx_writer.write(file(filepath, geom, compress))
+                    times.append(time.perf_counter() - start)
+                sizes[mode] = os.path.getsize(filepath)
+                print("%10d  %-4s  %10.1f  %10.1f  %6.2f" % (quads, mode, statistics.median(times) * 1000,
+                    sizes[mode] / 1024, sizes[mode] / sizes['FAST']))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
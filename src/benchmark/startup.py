@@ -0,0 +1,151 @@
+'''
+Measures how long Blender takes to import and register the add-on of this working tree.
+
+    blender -b --factory-startup --python src/benchmark/startup.py -- --runs 5 --json startup.json
+    blender -b --factory-startup --python src/benchmark/startup.py -- --baseline startup.json
+
+Every run starts a fresh Blender process, because a module is only imported once per process.
+The summary lists the median import and register times, the expensive modules that were loaded eagerly
+and what importing the modules that are only loaded on first use costs.
+With --baseline the script compares against an earlier --json result and exits with 1 if the add-on got slower
+than the tolerance allows.
+'''
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ADDON = 'medieval_engineers'
+SOURCES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'python')
+
+# expensive modules that the add-on should only load on first use
+WATCHED = (
+    'requests',
+    'numpy',
+    ADDON + '.fbx',
+    ADDON + '.fbx_writer',
+    ADDON + '.fbx_fast',
+    ADDON + '.merge_xml',
+    ADDON + '.scheduler',
+    ADDON + '.artifact_cache',
+    ADDON + '.manifest',
+    ADDON + '.parallel',
+    ADDON + '.cli',
+    ADDON + '.server',
+)
+
+RESULT_PREFIX = '@startup-benchmark '
+
+def measure() -> dict:
+    '''Runs in the child process: imports, registers and unregisters the add-on once.'''
+    sys.path.insert(0, SOURCES)
+
+    start = time.perf_counter()
+    addon = importlib.import_module(ADDON)
+    imported = time.perf_counter()
+    addon.register()
+    registered = time.perf_counter()
+
+    eager = [m for m in WATCHED if m in sys.modules]
+
+    lazy = {}
+    for module in WATCHED:
+        if not module in sys.modules:
+            begin = time.perf_counter()
+            importlib.import_module(module)
+            lazy[module] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    addon.unregister()
+    unregistered = time.perf_counter()
+
+    return {
+        'import': imported - start,
+        'register': registered - imported,
+        'unregister': unregistered - begin,
+        'eager': eager,
+        'lazy': lazy,
+    }
+
+def run_child(blender: str) -> dict:
+    cmd = [blender, '-b', '--factory-startup', '--python', os.path.abspath(__file__), '--', '--child']
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, check=True)
+    for line in output.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError("no result from Blender:\n" + output.stdout)
+
+def summarize(runs: list) -> dict:
+    lazy = {}
+    for module in WATCHED:
+        times = [r['lazy'][module] for r in runs if module in r['lazy']]
+        if times:
+            lazy[module] = statistics.median(times)
+    return {
+        'runs': len(runs),
+        'import': statistics.median(r['import'] for r in runs),
+        'register': statistics.median(r['register'] for r in runs),
+        'unregister': statistics.median(r['unregister'] for r in runs),
+        'eager': sorted(set(m for r in runs for m in r['eager'])),
+        'lazy': lazy,
+    }
+
+def report(summary: dict, baseline: dict=None, tolerance: float=0.2) -> bool:
+    ok = True
+    print("startup of %s, median of %d runs:" % (ADDON, summary['runs']))
+    for phase in ('import', 'register', 'unregister'):
+        line = "  %-10s %8.1f ms" % (phase, summary[phase] * 1000)
+        if baseline:
+            before = baseline[phase]
+            change = (summary[phase] - before) / before if before > 0 else 0.0
+            line += "  (baseline %8.1f ms, %+.0f%%)" % (before * 1000, change * 100)
+            if change > tolerance and phase != 'unregister':
+                line += "  SLOWER"
+                ok = False
+        print(line)
+
+    print("expensive modules loaded at startup: %s" % (", ".join(summary['eager']) or "none"))
+    if baseline:
+        added = sorted(set(summary['eager']) - set(baseline['eager']))
+        if added:
+            print("  newly loaded at startup: %s" % ", ".join(added))
+            ok = False
+    for module, seconds in summary['lazy'].items():
+        print("  first use of %-30s %8.1f ms" % (module, seconds * 1000))
+    return ok
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='startup.py', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help="number of Blender processes to measure")
+    parser.add_argument('--json', metavar='FILE', help="write the summary to this file")
+    parser.add_argument('--baseline', metavar='FILE', help="compare with a summary written by --json")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown against the baseline, 0.2 is 20%%")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(RESULT_PREFIX + json.dumps(measure()), flush=True)
+        return 0
+
+    import bpy
+    runs = [run_child(bpy.app.binary_path) for _ in range(max(1, args.runs))]
+    summary = summarize(runs)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    ok = report(summary, baseline, args.tolerance)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    sys.exit(main(argv))
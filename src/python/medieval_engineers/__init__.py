@@ -27,13 +27,24 @@ if not reload('texture_files'): from . import texture_files
 if not reload('pbr_node_group'): from . import pbr_node_group
 if not reload('types'): from . import types
 if not reload('mwmbuilder'): from . import mwmbuilder
-if not reload('fbx'): from . import fbx
+# modules that are only loaded on first use are reloaded if they have been loaded already
+reload('fbx')
+reload('fbx_writer')
+reload('fbx_fast')
 if not reload('havok_options'): from . import havok_options
-if not reload('merge_xml'): from . import merge_xml
+reload('merge_xml')
+if not reload('tracing'): from . import tracing
+if not reload('mesh_cache'): from . import mesh_cache
+reload('scheduler')
+reload('artifact_cache')
+reload('manifest')
 if not reload('export'): from . import export
 if not reload('nodes'): from . import nodes
 if not reload('default_nodes'): from . import nodes
+reload('parallel')
 if not reload('operators'): from . import operators
+reload('cli')
+reload('server')
 if not reload('versions'): from . import versions
 
 del modules
@@ -108,6 +119,7 @@ def register():
     bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
 
     nodes.register()
+    mesh_cache.register()
 
     register_class(MEView3DToolsPanel)
 
@@ -117,7 +129,10 @@ def unregister():
 
     unregister_class(MEView3DToolsPanel)
 
+    mesh_cache.unregister()
     nodes.unregister()
+    if 'fbx_fast' in globals():
+        fbx_fast.shutdown()
 
     bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
 
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import tempfile
+import threading
+from os.path import join
+
+from .utils import link_or_copy
+
+STORE_PREFIX = 'store_' # temporary files of entries that are being stored
+
+def tool_identity(toolPath: str) -> str:
+    '''Identifies a tool binary by its path, size and modification time, so updating the tool invalidates the cache.'''
+    stat = os.stat(toolPath)
+    return "%s|%d|%d" % (os.path.normcase(toolPath), stat.st_size, stat.st_mtime_ns)
+
+class ArtifactCache:
+    '''
+    An on-disk cache of tool outputs (.mwm, .hkt) that is addressed by a hash over all the inputs of the tool run.
+    The cache survives between exports and Blender sessions. Its size is capped by evicting the least recently
+    used entries. Lookups and stores may happen in the worker threads of a ToolScheduler.
+    '''
+
+    def __init__(self, directory: str, maxSize: int):
+        self.directory = directory
+        self.maxSize = maxSize # in bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, files=(), tools=(), extra=()) -> str:
+        '''
+        Hashes the content of the given input files, the identity of the given tools and any extra strings.
+        Missing inputs (None) are part of the key as well.
+        '''
+        h = hashlib.sha256()
+        for file in files:
+            if file is None:
+                h.update(b'\0none\0')
+                continue
+            with open(file, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            h.update(b'\0file\0')
+        for tool in tools:
+            h.update(tool_identity(tool).encode('utf-8'))
+            h.update(b'\0tool\0')
+        for value in extra:
+            h.update(str(value).encode('utf-8'))
+            h.update(b'\0extra\0')
+        return h.hexdigest()
+
+    def path(self, key: str, ext: str) -> str:
+        return join(self.directory, key[:2], key + ext)
+
+    def fetch(self, key: str, dstfile: str) -> bool:
+        '''Places the cached artifact at dstfile. Returns False and counts a miss if there is none.'''
+        cachefile = self.path(key, os.path.splitext(dstfile)[1])
+        try:
+            if not os.path.isfile(cachefile):
+                raise FileNotFoundError(cachefile)
+            # never hardlink: the tools overwrite their output files in place which would corrupt the cache
+            link_or_copy(cachefile, dstfile, allowHardlink=False)
+            os.utime(cachefile) # the modification time tracks the last use for the eviction
+        except FileNotFoundError: # evicted concurrently
+            with self.lock:
+                self.misses += 1
+            return False
+
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def store(self, key: str, srcfile: str):
+        cachefile = self.path(key, os.path.splitext(srcfile)[1])
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        fd, tmpfile = tempfile.mkstemp(prefix=STORE_PREFIX, dir=os.path.dirname(cachefile))
+        os.close(fd)
+        try:
+            link_or_copy(srcfile, tmpfile, allowHardlink=False)
+            os.replace(tmpfile, cachefile) # atomic, concurrent exports never see a partial file
+        except OSError:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            raise
+
+    def evict(self) -> int:
+        '''Removes the least recently used entries until the cache fits its size. Returns the number of removed entries.'''
+        if not os.path.isdir(self.directory):
+            return 0
+
+        entries = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.startswith(STORE_PREFIX): # still being stored by an export
+                    continue
+                file = join(dirpath, filename)
+                try:
+                    stat = os.stat(file)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file))
+                total += stat.st_size
+
+        removed = 0
+        entries.sort()
+        for mtime, size, file in entries:
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(file)
+                removed += 1
+            except OSError:
+                continue
+            total -= size
+
+        return removed
+
+    def report(self, settings):
+        if self.hits or self.misses:
+            settings.info("artifact cache: %d hits, %d misses" % (self.hits, self.misses))
+        self.hits = self.misses = 0
@@ -0,0 +1,193 @@
+'''
+Exports blocks without Blender's user interface, e.g. on a build machine:
+
+    blender -b --python-exit-code 4 --python-expr "from medieval_engineers import cli; cli.run()" -- \\
+        Blocks.blend MoreBlocks.blend --scene "Wall*" --output-dir Models --json results.json
+
+Prints a JSON summary with the outcome, duration and files of every export-node and exits with one of the EXIT_* codes.
+Errors are recorded in the summary and mapped to EXIT_ERROR. --python-exit-code makes Blender exit with an error as well
+if the add-on can't even be loaded, without it Blender exits with 0 after printing the traceback.
+'''
+import argparse
+import fnmatch
+import json
+import os
+import sys
+import time
+import traceback
+from tempfile import TemporaryDirectory
+import bpy
+
+from .types import data, getExportNodeTree
+from .parallel import export_scenes
+
+EXIT_OK = 0
+EXIT_FAILED = 1 # at least one export-node failed
+EXIT_USAGE = 2 # same as argparse
+EXIT_PROBLEMS = 3 # no failures but at least one export-node reported problems
+EXIT_ERROR = 4 # an export could not run at all, e.g. because of missing tools or a missing .blend file
+
+_SEVERITY = {EXIT_OK: 0, EXIT_PROBLEMS: 1, EXIT_FAILED: 2, EXIT_ERROR: 3}
+
+def worse(a: int, b: int) -> int:
+    return a if _SEVERITY[a] >= _SEVERITY[b] else b
+
+class CollectingReporter:
+    '''
+    Prints the reports of an export to stderr and keeps them for the summary.
+    If given, forward(scene, level, message) is called for every report as well.
+    '''
+
+    def __init__(self, scene: str, forward=None):
+        self.scene = scene
+        self.forward = forward
+        self.messages = []
+
+    def report(self, type, message):
+        level = next(iter(type))
+        self.messages.append({'level': level, 'message': message})
+        print("%s: %s" % (level, message), file=sys.stderr)
+        if not self.forward is None:
+            self.forward(self.scene, level, message)
+
+def parse_args(argv: list):
+    parser = argparse.ArgumentParser(
+        prog='blender -b --python-exit-code 4 --python-expr "from %s import cli; cli.run()" --' % (__package__),
+        description="Exports Medieval Engineers blocks from .blend files.")
+    parser.add_argument('blendfiles', nargs='*', metavar='BLEND',
+        help="the .blend files to export, defaults to the file Blender was started with")
+    parser.add_argument('--scene', action='append', dest='scenes', metavar='PATTERN',
+        help="only export block-scenes whose name matches this wildcard pattern, can be repeated")
+    parser.add_argument('--output-dir', metavar='DIR',
+        help="export into this directory instead of each scene's export path")
+    parser.add_argument('--settings', metavar='NODETREE',
+        help="use this export node-tree instead of each scene's own")
+    parser.add_argument('--skip-mwmbuilder', action='store_true',
+        help="export intermediary files but do not run them through mwmbuilder")
+    parser.add_argument('--batch-mwmbuilder', action='store_true',
+        help="run mwmbuilder only once per block size")
+    parser.add_argument('--only-changed', action='store_true',
+        help="skip models that did not change since they were last exported")
+    parser.add_argument('--json', metavar='FILE', default='-',
+        help="write the summary to this file instead of stdout")
+    return parser.parse_args(argv)
+
+def select_scenes(patterns: list) -> list:
+    scenes = [scene for scene in bpy.data.scenes if data(scene) and data(scene).is_block]
+    if not patterns:
+        return scenes
+    return [scene for scene in scenes if any(fnmatch.fnmatchcase(scene.name, p) for p in patterns)]
+
+def export_blendfile(args, blendfile: str, summary: dict, forward=None) -> int:
+    '''Exports the selected scenes of the currently open .blend file and adds their results to the summary.'''
+    exitCode = EXIT_OK
+
+    if args.settings and getExportNodeTree(args.settings) is None:
+        summary['errors'].append({'blendfile': blendfile, 'message': "no export node-tree named '%s'" % (args.settings)})
+        return EXIT_ERROR
+
+    options = {
+        'outputDir': os.path.abspath(args.output_dir) if args.output_dir else None,
+        'settingsName': args.settings,
+        'skipMwmbuilder': args.skip_mwmbuilder,
+        'batchMwmbuilder': args.batch_mwmbuilder,
+        'onlyChanged': args.only_changed,
+    }
+
+    reporters = {}
+    def reporter(scene):
+        reporters[scene.name] = CollectingReporter(scene.name, forward)
+        return reporters[scene.name]
+
+    with TemporaryDirectory() as mwmDir:
+        start = time.perf_counter()
+        for scene, export in export_scenes(select_scenes(args.scenes), options, reporter, mwmDir):
+            messages = reporters[scene.name].messages
+            if export is None:
+                summary['errors'].append({'blendfile': blendfile, 'scene': scene.name,
+                                          'message': messages[-1]['message'] if messages else "export failed"})
+                exitCode = worse(exitCode, EXIT_ERROR)
+                continue
+
+            for result in export.results.values():
+                summary['nodes'].append({
+                    'blendfile': blendfile,
+                    'scene': scene.name,
+                    'cubeSize': result.cubeSize,
+                    'node': result.name,
+                    'outcome': result.outcome,
+                    'duration': round(result.duration, 3),
+                    'artifacts': [f for f in result.files if os.path.isfile(f)],
+                })
+                if result.outcome == 'FAILED':
+                    exitCode = worse(exitCode, EXIT_FAILED)
+                elif result.outcome == 'PROBLEMS':
+                    exitCode = worse(exitCode, EXIT_PROBLEMS)
+
+            summary['scenes'].append({
+                'blendfile': blendfile,
+                'scene': scene.name,
+                'duration': round(time.perf_counter() - start, 3),
+                'messages': messages,
+            })
+            start = time.perf_counter()
+
+    return exitCode
+
+def open_blendfile(blendfile: str) -> bool:
+    if not blendfile or not os.path.isfile(blendfile):
+        return False
+    if bpy.data.filepath != blendfile:
+        bpy.ops.wm.open_mainfile(filepath=blendfile)
+    return True
+
+def export(args, forward=None) -> tuple:
+    '''Runs the export described by the parsed arguments. Returns the exit-code and the summary.'''
+    summary = {'nodes': [], 'scenes': [], 'errors': []}
+    exitCode = EXIT_OK
+
+    blendfiles = [os.path.abspath(f) for f in args.blendfiles] or [bpy.data.filepath]
+    for blendfile in blendfiles:
+        try:
+            if not open_blendfile(blendfile):
+                summary['errors'].append({'blendfile': blendfile, 'message': "no such .blend file"})
+                exitCode = worse(exitCode, EXIT_ERROR)
+                continue
+
+            exitCode = worse(exitCode, export_blendfile(args, blendfile, summary, forward))
+        except Exception as e: # the next .blend file might work
+            traceback.print_exc()
+            summary['errors'].append({'blendfile': blendfile, 'message': "%s: %s" % (type(e).__name__, e)})
+            exitCode = worse(exitCode, EXIT_ERROR)
+
+    summary['exitCode'] = exitCode
+    return exitCode, summary
+
+def main(argv: list=None) -> int:
+    if argv is None:
+        argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    try:
+        args = parse_args(argv)
+    except SystemExit as e: # argparse exits on --help and on errors
+        return e.code if isinstance(e.code, int) else EXIT_USAGE
+
+    try:
+        exitCode, summary = export(args)
+    except Exception as e:
+        traceback.print_exc()
+        exitCode = EXIT_ERROR
+        summary = {'nodes': [], 'scenes': [], 'errors': [{'message': "%s: %s" % (type(e).__name__, e)}],
+                   'exitCode': exitCode}
+
+    if args.json == '-':
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+    return exitCode
+
+def run():
+    '''Runs main() and exits Blender with its exit-code.'''
+    sys.exit(main())
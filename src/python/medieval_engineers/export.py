@@ -3,16 +3,18 @@ import re
 import subprocess
 import tempfile
 import bpy
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import wait
 from os.path import basename, join
-from string import Template
 from xml.etree import ElementTree
 import shutil
 from mathutils import Matrix
 
-from .utils import scaleUni, md5sum
+from .utils import scaleUni, md5sum, link_or_copy, compiledTemplate
 from .types import data, prefs, getBaseDir, MESceneProperties
-from .fbx import save_single
+from .mwmbuilder import mwmbuilder_xml
+from . import mesh_cache
+from .tracing import traced
 
 from bpy_extras.io_utils import axis_conversion, ExportHelper
 
@@ -30,6 +32,10 @@ class MissbehavingToolError(subprocess.SubprocessError):
     def __str__(self):
         return self.message
 
+class FbxWriteError(Exception):
+    '''An .fbx file that was written in the background could not be written, see ExportSettings.awaitFile().'''
+    pass
+
 def tool_path(propertyName, displayName, toolPath=None):
     if None == toolPath:
         toolPath = getattr(bpy.context.preferences.addons['medieval_engineers'].preferences, propertyName)
@@ -43,22 +49,61 @@ def tool_path(propertyName, displayName, toolPath=None):
 
     return toolPath
 
-def write_to_log(logfile, content, cmdline=None, cwd=None, loglines=[]):
-    with open(logfile, 'wb') as log:
-        if cwd:
-            str = "Running from: %s \n" % (cwd)
-            log.write(str.encode('utf-8'))
+def artifact_cache(prefs):
+    if not prefs.use_artifact_cache:
+        return None
+    from .artifact_cache import ArtifactCache
+    directory = prefs.artifact_cache_dir
+    if directory:
+        directory = os.path.normpath(bpy.path.abspath(directory))
+    else:
+        directory = join(tempfile.gettempdir(), 'medieval_engineers_artifacts')
+    return ArtifactCache(directory, prefs.artifact_cache_size * 1024 * 1024)
+
+def open_log(logfile, cmdline=None, cwd=None, loglines=[]):
+    log = open(logfile, 'wb')
+    if cwd:
+        str = "Running from: %s \n" % (cwd)
+        log.write(str.encode('utf-8'))
 
-        if cmdline:
-            str = "Command: %s \n" % (" ".join(cmdline))
-            log.write(str.encode('utf-8'))
+    if cmdline:
+        str = "Command: %s \n" % (" ".join(cmdline))
+        log.write(str.encode('utf-8'))
 
-        for line in loglines:
-            log.write(line.encode('utf-8'))
-            log.write(b"\n")
+    for line in loglines:
+        log.write(line.encode('utf-8'))
+        log.write(b"\n")
 
+    return log
+
+def write_to_log(logfile, content, cmdline=None, cwd=None, loglines=[]):
+    with open_log(logfile, cmdline=cmdline, cwd=cwd, loglines=loglines) as log:
         log.write(content)
 
+# how much of a tool's output callTool() keeps in memory, the log-file always gets all of it
+MAX_TOOL_OUTPUT = 256 * 1024
+
+class OutputTail:
+    '''Keeps the last lines of a tool's output up to a maximum number of bytes.'''
+
+    def __init__(self, maxSize=MAX_TOOL_OUTPUT):
+        self.maxSize = maxSize
+        self.lines = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def append(self, line: bytes):
+        self.lines.append(line)
+        self.size += len(line)
+        while self.size > self.maxSize and len(self.lines) > 1:
+            self.size -= len(self.lines.popleft())
+            self.dropped += 1
+
+    def bytes(self) -> bytes:
+        if self.dropped:
+            return b"[... %d lines omitted, see the log-file ...]\n" % (self.dropped) + b''.join(self.lines)
+        return b''.join(self.lines)
+
 def pretty_xml(elem: ElementTree.Element, level=0, indent="\t"):
     i = "\n" + level*indent
     if len(elem):
@@ -74,6 +119,7 @@ def pretty_xml(elem: ElementTree.Element, level=0, indent="\t"):
         if level and (not elem.tail or not elem.tail.strip()):
             elem.tail = i
 
+@traced('write_pretty_xml')
 def write_pretty_xml(elem: ElementTree.Element, filepath: str):
     pretty_xml(elem, indent="\t")
     ElementTree.ElementTree(elem).write(
@@ -94,21 +140,40 @@ def func():
 _FUNCTION_TYPE = type(func)
 del func
 
+class Substitutions(dict):
+    '''
+    The parameters of ExportSettings for template strings, each looked up once.
+    Also keeps the texts that were expanded with them, see TextSocket.getText().
+    '''
+    __slots__ = ('settings', 'texts')
+
+    def __init__(self, settings):
+        super().__init__()
+        self.settings = settings
+        self.texts = {}
+
+    def __missing__(self, key):
+        value = self[key] = self.settings[key]
+        return value
+
 class ExportSettings:
     def __init__(self, scene, outputDir=None, exportNodes=None, mwmDir=None):
         def typeCast(data) -> MESceneProperties: # allows type inference in IDE
             return data
 
+        self._params = None # see params
         self.scene = scene # ObjectSource.getObjects() uses .utils.scene() instead
         self.sceneData = typeCast(data(scene))
         self.outputDir = os.path.normpath(bpy.path.abspath(self.sceneData.export_path if outputDir is None else outputDir))
         self.exportNodes = bpy.data.node_groups[self.sceneData.export_nodes] if exportNodes is None else exportNodes
         self.baseDir = getBaseDir(scene)
-        # temporary working directory. used as a workaround for two bugs in mwmbuilder. must be empty initially.
+        # temporary working directory. used as a workaround for two bugs in mwmbuilder.
+        # every MwmBuilder run creates its own scratch directory in here.
         self.mwmDir = mwmDir if not mwmDir is None else self.outputDir
         self.operator = STDOUT_OPERATOR
         self.isLogToolOutput = True
         self.isRunMwmbuilder = True
+        self.isBatchMwmbuilder = False
         self.isFixDirBug = prefs().fix_dir_bug
         self.names = Names()
         self.isUseTangentSpace = False
@@ -119,6 +184,28 @@ class ExportSettings:
         # set multiple times on export
         self.scaleDown = None
         self._hadErrors = False
+        # collects the MwmBuilder jobs of one export pass if isBatchMwmbuilder is set, see MwmBuilderBatch
+        self.mwmBatch = None
+        # runs external tools concurrently if more than one tool-run is allowed, see scheduler.ToolScheduler
+        self.maxToolJobs = prefs().max_tool_jobs
+        self.scheduler = None
+        # reuses tool results of earlier exports, see artifact_cache.ArtifactCache
+        self.artifactCache = artifact_cache(prefs())
+        # skips exporting files whose inputs didn't change since the last export, see manifest.ExportManifest
+        self.isIncremental = False
+        self.manifest = None
+        self.fingerprints = {}
+        # records spans of the export if set, see tracing.Tracer
+        self.isTracing = prefs().use_tracing
+        # .fbx files that are still being written by worker processes, see fbx_fast.save_async()
+        self.fbxWriterProcesses = prefs().fbx_writer_processes
+        self.pendingFiles = {}
+        # bakes the actions of animated .fbx files in background Blender processes, see parallel.bake_actions_parallel()
+        self.bakeProcesses = prefs().bake_processes
+        self.failedFiles = set() # pending files whose error awaitFile() already raised
+        # durations of exports that ran as dependencies of other exports, see ExportSocket.export()
+        self.nestedDurations = [] # one accumulator per export in progress
+        self.dependencyDurations = {} # node name -> seconds spent in its own export
 
         # substitution parameters
         # self.BlockPairName # corresponds with element-name in CubeBlocks.sbc, see property below
@@ -135,6 +222,8 @@ class ExportSettings:
         self.SubtypeId = None # corresponds with element-name in CubeBlocks.sbc
 
         self.cache = {}
+        # like cache, but kept for all passes of an export. only for values that don't depend on the block size
+        self.sharedCache = {}
 
     @property
     def CubeSize(self):
@@ -190,22 +279,50 @@ class ExportSettings:
             return True
         return False
 
-    def callTool(self, cmdline, logfile=None, cwd=None, successfulExitCodes=[0], loglines=[], logtextInspector=None):
+    def callTool(self, cmdline, logfile=None, cwd=None, successfulExitCodes=[0], loglines=[], lineInspector=None):
+        '''
+        Runs an external tool and streams its output line by line into the log-file and through lineInspector(line).
+        If lineInspector raises, the tool is stopped right away and the exception is passed on.
+        Returns the tail of the output, see MAX_TOOL_OUTPUT.
+        '''
+        tail = OutputTail()
+        log = open_log(logfile, cmdline=cmdline, cwd=cwd, loglines=loglines) if self.isLogToolOutput and logfile else None
         try:
-            out = subprocess.check_output(cmdline, cwd=cwd, stderr=subprocess.STDOUT)
-            if self.isLogToolOutput and logfile:
-                write_to_log(logfile, out, cmdline=cmdline, cwd=cwd, loglines=loglines)
-            if not logtextInspector is None:
-                logtextInspector(out)
-
-        except subprocess.CalledProcessError as e:
-            if self.isLogToolOutput and logfile:
-                write_to_log(logfile, e.output, cmdline=cmdline, cwd=cwd, loglines=loglines)
-            if not e.returncode in successfulExitCodes:
+            process = subprocess.Popen(cmdline, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            try:
+                for line in process.stdout:
+                    if not log is None:
+                        log.write(line)
+                        log.flush() # the log-file can be watched while the tool runs
+                    tail.append(line)
+                    if not lineInspector is None:
+                        lineInspector(line)
+                returncode = process.wait()
+            except BaseException:
+                process.kill()
+                process.wait()
                 raise
+            finally:
+                process.stdout.close()
+        finally:
+            if not log is None:
+                log.close()
+
+        output = tail.bytes()
+        if returncode != 0 and not returncode in successfulExitCodes:
+            raise subprocess.CalledProcessError(returncode, cmdline, output=output)
+        return output
+
+    @property
+    def params(self) -> Substitutions:
+        '''The parameters for template strings. They are dropped as soon as an attribute of the settings is set.'''
+        params = self._params
+        if params is None:
+            params = self._params = Substitutions(self)
+        return params
 
     def template(self, templateString, **kwargs):
-        return Template(templateString).safe_substitute(self, **kwargs)
+        return compiledTemplate(templateString).expand(kwargs, self.params)
 
     def msg(self, level, msg, file=None, node = None):
         if not file is None and not node is None:
@@ -229,10 +346,56 @@ class ExportSettings:
     def text(self, msg, file=None, node = None):
         self.msg('OPERATOR', msg, file, node)
 
+    def isUnchanged(self, file: str, fingerprint) -> bool:
+        '''
+        Remembers the manifest.Fingerprint of the file
+        and checks if the file was exported with that same fingerprint before.
+        '''
+        digest = fingerprint.hexdigest()
+        self.fingerprints[file] = digest
+        return self.manifest.isClean(file, digest)
+
+    def awaitFile(self, file: str):
+        '''Waits until the file is written if that happens in the background. Raises the error of a failed write.'''
+        future = self.pendingFiles.get(file, None)
+        if not future is None:
+            try:
+                future.result()
+            except Exception as e: # e.g. OSError or BrokenProcessPool
+                self.failedFiles.add(file)
+                raise FbxWriteError("writing %s failed: %s" % (basename(file), e)) from e
+
+    def awaitFiles(self, raiseErrors=True):
+        '''
+        Waits until all files that are written in the background are complete.
+        Raises the first error that awaitFile() didn't raise already.
+        '''
+        files, futures = list(self.pendingFiles.keys()), list(self.pendingFiles.values())
+        failedFiles = set(self.failedFiles)
+        self.pendingFiles.clear()
+        self.failedFiles.clear()
+        wait(futures)
+        if raiseErrors:
+            for file, future in zip(files, futures):
+                if file in failedFiles:
+                    continue
+                try:
+                    future.result()
+                except Exception as e:
+                    raise FbxWriteError("writing %s failed: %s" % (basename(file), e)) from e
+
     def cacheValue(self, key, value):
         self.cache[key] = value
         return value
 
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            super().__setattr__(name, value)
+        else:
+            self._params = None # setters like CubeSize's already expand templates
+            super().__setattr__(name, value)
+            self._params = None
+
     def __getitem__(self, key): # makes all attributes available for parameter substitution
         if not type(key) is str or key.startswith('_'):
             raise KeyError(key)
@@ -249,7 +412,20 @@ class ExportSettings:
 # MATRIX_NORMAL = axis_conversion(to_forward=FWD, to_up=UP).to_4x4()
 # MATRIX_SCALE_DOWN = Matrix.Scale(0.2, 4) * MATRIX_NORMAL
 
-def export_fbx(settings: ExportSettings, filepath, objects, fbx_settings = None):
+def _fbx_request_key(fbxSettings: dict, scaleDown) -> tuple:
+    # global_matrix is derived from the other settings and the scale
+    return (scaleDown, frozenset(o.name for o in fbxSettings['context_objects'])) + tuple(sorted(
+        (k, frozenset(v) if isinstance(v, set) else v)
+        for k, v in fbxSettings.items() if not k in ('context_objects', 'global_matrix')))
+
+@traced('export_fbx')
+def export_fbx(settings: ExportSettings, filepath, objects, fbx_settings = None) -> str:
+    '''
+    Exports the objects to filepath and returns the path of the exported file.
+    If the same objects were already exported with the same settings during this export pass
+    that earlier file is returned instead and nothing is exported. Its content is still placed at filepath then,
+    so that filepath doesn't keep what an older export left there.
+    '''
 
     fbxSettings = {
         # FBX operator defaults
@@ -293,6 +469,9 @@ def export_fbx(settings: ExportSettings, filepath, objects, fbx_settings = None)
         'armature_nodetype': 'NULL',
         'primary_bone_axis': 'X',
         'secondary_bone_axis': 'Y',
+        # the .hkt.fbx is only read by Havok's importer and then thrown away
+        'array_compression': 'NONE',
+        'use_instancing': False,
     }
 
     if fbx_settings:
@@ -302,7 +481,7 @@ def export_fbx(settings: ExportSettings, filepath, objects, fbx_settings = None)
 
     # these cannot be overriden and are always set here
     fbxSettings['use_selection'] = False # because of context_objects
-    fbxSettings['context_objects'] = objects
+    fbxSettings['context_objects'] = list(objects)
 
     global_matrix = axis_conversion(to_forward=fbxSettings['axis_forward'], to_up=fbxSettings['axis_up']).to_4x4()
     scale = fbxSettings['global_scale']
@@ -312,13 +491,56 @@ def export_fbx(settings: ExportSettings, filepath, objects, fbx_settings = None)
         global_matrix = Matrix.Scale(scale, 4) * global_matrix
     fbxSettings['global_matrix'] = global_matrix
 
-    return save_single(
+    key = ('export_fbx', _fbx_request_key(fbxSettings, settings.scaleDown))
+    written = settings.cache.setdefault(('export_fbx', 'files'), set())
+    earlier = settings.cache.get(key, None)
+    if not earlier is None:
+        if earlier != filepath and not filepath in written:
+            settings.awaitFile(earlier)
+            try:
+                settings.awaitFile(filepath)
+            except FbxWriteError:
+                pass # replaced below
+            # no hardlink, the next export pass might write either file in place
+            link_or_copy(earlier, filepath, allowHardlink=False)
+            written.add(filepath)
+        return earlier
+    settings.cache[key] = filepath
+    written.add(filepath)
+
+    try:
+        settings.awaitFile(filepath) # an earlier write of the same file might still be running
+    except FbxWriteError:
+        pass # the file is written again below
+
+    # cloning Blender's FBX exporter and importing NumPy take a while, so only on the first export
+    from .fbx import save_single, attribute_table
+    from . import fbx_fast
+
+    fbxSettings['object_attributes'] = attribute_table(fbxSettings['context_objects'], settings.scaleDown)
+
+    # meshes and empties without animation, the common case for blocks, take the faster route
+    if fbx_fast.canWrite(fbxSettings):
+        if fbxSettings['use_instancing'] and fbx_fast.hasInstances(fbxSettings):
+            fbxSettings['use_instancing'] = mwmbuilder_accepts_instancing(settings)
+        if settings.fbxWriterProcesses > 0:
+            settings.pendingFiles[filepath] = fbx_fast.save_async(settings.fbxWriterProcesses,
+                settings.operator, settings.scene, filepath=filepath, **fbxSettings)
+            return filepath
+        save = fbx_fast.save_single
+    else:
+        fbxSettings['bake_processes'] = settings.bakeProcesses
+        save = save_single
+
+    save(
         settings.operator,
         settings.scene,
         filepath=filepath,
         **fbxSettings
     )
+    return filepath
 
+@traced('fbx_to_hkt')
 def fbx_to_hkt(settings: ExportSettings, srcfile, dstfile):
     settings.callTool(
         [settings.fbximporter, srcfile, dstfile],
@@ -327,6 +549,7 @@ def fbx_to_hkt(settings: ExportSettings, srcfile, dstfile):
 
 from .havok_options import HAVOK_OPTION_FILE_CONTENT
 
+@traced('hkt_filter')
 def hkt_filter(settings: ExportSettings, srcfile, dstfile, options=HAVOK_OPTION_FILE_CONTENT):
     hko = tempfile.NamedTemporaryFile(mode='wt', prefix='medieval_engineers_', suffix=".hko", delete=False)
     try:
@@ -340,32 +563,299 @@ def hkt_filter(settings: ExportSettings, srcfile, dstfile, options=HAVOK_OPTION_
     finally:
         os.remove(hko.name)
 
+@traced('mwmbuilder')
 def mwmbuilder(settings: ExportSettings, fbxfile: str, havokfile: str, paramsfile: str, mwmfile: str):
     if not settings.isRunMwmbuilder:
         if settings.isLogToolOutput:
             write_to_log(mwmfile+'.log', b"mwmbuilder skipped.")
         return
 
-    contentDir = join(settings.mwmDir, 'Content')
-    os.makedirs(contentDir, exist_ok = True)
-    basename = os.path.splitext(os.path.basename(mwmfile))[0]
+    settings.awaitFile(fbxfile)
+    cache = settings.artifactCache
+    if not cache is None:
+        key = mwmbuilder_cache_key(settings, fbxfile, havokfile, paramsfile, mwmfile)
+        if cache.fetch(key, mwmfile):
+            if settings.isLogToolOutput:
+                write_to_log(mwmfile+'.log', b"mwmbuilder skipped, the .mwm was restored from the artifact cache.")
+            return
 
-    def copy(srcfile: str, dstfile: str):
-        if not srcfile is None and dstfile != srcfile:
-            shutil.copy2(srcfile, dstfile)
+    basename = os.path.splitext(os.path.basename(mwmfile))[0]
 
-    copy(fbxfile, join(contentDir, basename + '.fbx'))
-    copy(paramsfile, join(contentDir, basename + '.xml'))
-    copy(havokfile, join(contentDir, basename + '.hkt'))
+    def stage(srcfile: str, dstfile: str):
+        if not srcfile is None:
+            link_or_copy(srcfile, dstfile)
 
     cmdline = [settings.mwmbuilder, '/s:Content', '/m:'+basename+'.fbx', '/o:.\\']
 
-    def checkForLoggedErrors(logtext):
-        if b": ERROR:" in logtext:
+    def checkForLoggedErrors(line):
+        if b": ERROR:" in line:
             raise MissbehavingToolError('MwmBuilder failed without an appropriate exit-code. Please check the log-file.')
 
-    settings.callTool(cmdline, cwd=settings.mwmDir, logfile=mwmfile+'.log', logtextInspector=checkForLoggedErrors)
-    copy(join(settings.mwmDir, basename + '.mwm'), mwmfile)
+    # every run gets its own scratch directory so that concurrent runs don't see each other's files
+    jobDir = tempfile.mkdtemp(prefix=basename + '_', dir=settings.mwmDir)
+    try:
+        contentDir = join(jobDir, 'Content')
+        os.makedirs(contentDir)
+
+        stage(fbxfile, join(contentDir, basename + '.fbx'))
+        stage(paramsfile, join(contentDir, basename + '.xml'))
+        stage(havokfile, join(contentDir, basename + '.hkt'))
+
+        settings.callTool(cmdline, cwd=jobDir, logfile=mwmfile+'.log', lineInspector=checkForLoggedErrors)
+        shutil.move(join(jobDir, basename + '.mwm'), mwmfile)
+    finally:
+        shutil.rmtree(jobDir, ignore_errors=True)
+
+    if not cache is None:
+        cache.store(key, mwmfile)
+
+def mwmbuilder_cache_key(settings: ExportSettings, fbxfile: str, havokfile: str, paramsfile: str, mwmfile: str) -> str:
+    return settings.artifactCache.key(
+        files=(fbxfile, havokfile, paramsfile),
+        tools=(settings.mwmbuilder,),
+        extra=(os.path.basename(mwmfile),)) # in case MwmBuilder embeds the name
+
+_instancingSupport = {} # path of MwmBuilder -> True if it accepts objects that share a Geometry
+
+def mwmbuilder_accepts_instancing(settings: ExportSettings) -> bool:
+    '''
+    Checks once per MwmBuilder and session that it builds the same .mwm from two objects that share one Geometry
+    as from two objects with a Geometry each.
+    '''
+    if not settings.isRunMwmbuilder:
+        return False
+    try:
+        tool = settings.mwmbuilder
+    except FileNotFoundError:
+        return False
+
+    accepted = _instancingSupport.get(tool, None)
+    if accepted is None:
+        accepted = _instancingSupport[tool] = _probe_instancing(settings)
+        if not accepted:
+            settings.text("MwmBuilder doesn't accept shared geometry, meshes are exported per object")
+    return accepted
+
+@traced('probe_instancing')
+def _probe_instancing(settings: ExportSettings) -> bool:
+    from . import fbx_fast
+
+    mesh = bpy.data.meshes.new('MwmBuilderInstancingProbe')
+    mesh.from_pydata([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)], [], [(0, 1, 2, 3)])
+    mesh.update()
+    objects = [bpy.data.objects.new('MwmBuilderInstancingProbe%d' % i, mesh) for i in range(2)]
+    objects[1].location = (2, 0, 0)
+
+    os.makedirs(settings.mwmDir, exist_ok=True)
+    probeDir = tempfile.mkdtemp(prefix='Instancing_', dir=settings.mwmDir)
+    try:
+        hashes = []
+        for use_instancing in (False, True):
+            jobDir = join(probeDir, 'Instanced' if use_instancing else 'Plain')
+            contentDir = join(jobDir, 'Content')
+            os.makedirs(contentDir)
+            fbx_fast.save_single(settings.operator, settings.scene, join(contentDir, 'Probe.fbx'),
+                context_objects=objects, object_types={'MESH'}, use_mesh_modifiers=False, use_instancing=use_instancing)
+            write_pretty_xml(mwmbuilder_xml(settings, [], []), join(contentDir, 'Probe.xml'))
+            settings.callTool([settings.mwmbuilder, '/s:Content', '/m:Probe.fbx', '/o:.\\'], cwd=jobDir)
+            hashes.append(md5sum(join(jobDir, 'Probe.mwm')))
+        # a tool that only sees one of the objects builds a different model
+        return hashes[0] == hashes[1]
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    finally:
+        shutil.rmtree(probeDir, ignore_errors=True)
+        mesh_cache.invalidateMesh(mesh.name)
+        for obj in objects:
+            bpy.data.objects.remove(obj)
+        bpy.data.meshes.remove(mesh)
+
+class MwmBuilderJob:
+    '''
+    A model that was prepared for MwmBuilder but whose .mwm is built later by a MwmBuilderBatch.
+    '''
+    def __init__(self, node, fbxfile: str, havokfile: str, paramsfile: str, mwmfile: str, hadErrors=False):
+        self.node = node
+        self.fbxfile = fbxfile
+        self.havokfile = havokfile
+        self.paramsfile = paramsfile
+        self.mwmfile = mwmfile
+        self.hadErrors = hadErrors # errors that were reported while preparing the input files
+        self.outcome = None
+        self.cacheKey = None
+
+    @property
+    def basename(self):
+        return os.path.splitext(os.path.basename(self.mwmfile))[0]
+
+class MwmBuilderLogSplitter:
+    '''
+    Splits the output of a MwmBuilder run over several models into one log-file per model while the tool runs.
+    A model's section starts at a line that mentions its .fbx file and lasts until another model is mentioned.
+    Every log-file starts with the lines before the first section.
+    '''
+    def __init__(self, jobs: list, isLog: bool, cmdline=None, cwd=None):
+        self.jobs = jobs
+        self.isLog = isLog
+        self.cmdline = cmdline
+        self.cwd = cwd
+        # anchored, so that the lines of XFoo.fbx don't count for Foo.fbx as well
+        self.patterns = [(job, re.compile(rb'(?<![\w.])' + re.escape(job.basename.encode('utf-8')) + rb'\.fbx\b', re.IGNORECASE))
+                         for job in jobs]
+        self.header = OutputTail()
+        self.headerHasErrors = False
+        self.logs = {}
+        self.errors = set() # jobs with errors in their section
+        self.current = None
+
+    def _log(self, job):
+        log = self.logs.get(job, None)
+        if log is None and self.isLog:
+            log = self.logs[job] = open_log(job.mwmfile+'.log', cmdline=self.cmdline, cwd=self.cwd,
+                loglines=["Batched run over %d models, showing the lines for %s.fbx" % (len(self.jobs), job.basename)])
+            log.write(self.header.bytes())
+        return log
+
+    def feed(self, line: bytes):
+        for job, pattern in self.patterns:
+            if pattern.search(line):
+                self.current = job
+                break
+
+        isError = b": ERROR:" in line
+        if self.current is None:
+            self.header.append(line)
+            self.headerHasErrors |= isError
+            return
+
+        if isError:
+            self.errors.add(self.current)
+        log = self._log(self.current)
+        if not log is None:
+            log.write(line)
+
+    def hasErrors(self, job) -> bool:
+        return self.headerHasErrors or job in self.errors
+
+    def close(self):
+        for job in self.jobs:
+            self._log(job) # models never mentioned get at least the header
+        for log in self.logs.values():
+            log.close()
+        self.logs.clear()
+
+class MwmBuilderBatch:
+    '''
+    Collects all models of an export pass in one staging directory so that MwmBuilder only starts once.
+    The produced .mwm files and log-sections are handed back to the nodes that asked for them.
+    '''
+    def __init__(self):
+        self.jobs = OrderedDict()
+
+    def add(self, job: MwmBuilderJob) -> MwmBuilderJob:
+        self.jobs[job.mwmfile] = job
+        return job
+
+    @traced('MwmBuilderBatch.run')
+    def run(self, settings: ExportSettings) -> list:
+        jobs = list(self.jobs.values())
+        self.jobs.clear()
+        if not jobs:
+            return jobs
+
+        for job in jobs:
+            # the conversion might have been scheduled and failed after the job was added
+            if settings.cache.get(job.havokfile, None) == 'FAILED':
+                job.havokfile = None
+
+        ready = []
+        for job in jobs:
+            try:
+                settings.awaitFile(job.fbxfile)
+                ready.append(job)
+            except FbxWriteError as e:
+                settings.error(str(e), file=job.mwmfile, node=job.node)
+                job.outcome = 'FAILED'
+
+        pending = [job for job in ready if not self._restore(settings, job)]
+
+        if pending:
+            batchDir = tempfile.mkdtemp(prefix='Batch_', dir=settings.mwmDir)
+            try:
+                self._run(settings, pending, batchDir)
+            finally:
+                shutil.rmtree(batchDir, ignore_errors=True)
+
+        _ = settings.hadErrors # errors are tracked per job, reset the global tracking
+
+        return jobs
+
+    def _run(self, settings: ExportSettings, jobs: list, batchDir: str):
+        contentDir = join(batchDir, 'Content')
+        os.makedirs(contentDir)
+
+        def stage(srcfile: str, dstfile: str):
+            if not srcfile is None:
+                link_or_copy(srcfile, dstfile)
+
+        for job in jobs:
+            stage(job.fbxfile, join(contentDir, job.basename + '.fbx'))
+            stage(job.paramsfile, join(contentDir, job.basename + '.xml'))
+            stage(job.havokfile, join(contentDir, job.basename + '.hkt'))
+
+        cmdline = [settings.mwmbuilder, '/s:Content', '/m:*.fbx', '/o:.\\']
+
+        failure = None
+        splitter = MwmBuilderLogSplitter(jobs, settings.isLogToolOutput, cmdline=cmdline, cwd=batchDir)
+        try:
+            settings.callTool(cmdline, cwd=batchDir, lineInspector=splitter.feed)
+        except subprocess.CalledProcessError as e:
+            failure = e
+        finally:
+            splitter.close()
+
+        for job in jobs:
+            if not failure is None:
+                settings.error(str(failure), file=job.mwmfile, node=job.node)
+                job.outcome = 'FAILED'
+            elif splitter.hasErrors(job):
+                settings.error('MwmBuilder failed without an appropriate exit-code. Please check the log-file.',
+                               file=job.mwmfile, node=job.node)
+                job.outcome = 'FAILED'
+            elif not os.path.isfile(join(batchDir, job.basename + '.mwm')):
+                settings.error('MwmBuilder produced no .mwm file. Please check the log-file.', file=job.mwmfile, node=job.node)
+                job.outcome = 'FAILED'
+            else:
+                shutil.move(join(batchDir, job.basename + '.mwm'), job.mwmfile)
+                if not job.cacheKey is None:
+                    settings.artifactCache.store(job.cacheKey, job.mwmfile)
+                self._succeed(settings, job)
+
+            settings.cacheValue(job.mwmfile, job.outcome)
+
+    def _restore(self, settings: ExportSettings, job: MwmBuilderJob) -> bool:
+        cache = settings.artifactCache
+        if cache is None:
+            return False
+
+        job.cacheKey = mwmbuilder_cache_key(settings, job.fbxfile, job.havokfile, job.paramsfile, job.mwmfile)
+        if not cache.fetch(job.cacheKey, job.mwmfile):
+            return False
+
+        if settings.isLogToolOutput:
+            write_to_log(job.mwmfile+'.log', b"mwmbuilder skipped, the .mwm was restored from the artifact cache.")
+        self._succeed(settings, job)
+        settings.cacheValue(job.mwmfile, job.outcome)
+        return True
+
+    def _succeed(self, settings: ExportSettings, job: MwmBuilderJob):
+        if not job.hadErrors:
+            settings.info("export successful", file=job.mwmfile, node=job.node)
+            job.outcome = 'SUCCESS'
+        else:
+            settings.warn("export completed with problems", file=job.mwmfile, node=job.node)
+            job.outcome = 'PROBLEMS'
+
 
 def generateBlockDefXml(
         settings: ExportSettings,
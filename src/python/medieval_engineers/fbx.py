@@ -1,7 +1,12 @@
+from array import array
 from collections import OrderedDict
-from . import types
+from contextlib import contextmanager
+import datetime
+from struct import pack
 from .utils import exportSettings, data
+from .manifest import Fingerprint
 import bpy
+from mathutils import Matrix
 
 _experimental = (bpy.app.version[0] == 2 and bpy.app.version[1] == 72)
 
@@ -48,6 +53,240 @@ def fbx_template_def_model(scene, settings, override_defaults=None, nbr_users=0)
 
 _fbx.fbx_template_def_model = fbx_template_def_model
 
+_original_fbx_header_elements = _fbx.fbx_header_elements
+
+# a fixed creation time makes exports of unchanged data byte-identical, the artifact cache relies on that
+CREATION_TIME = datetime.datetime(1970, 1, 1, 10, 0, 0)
+
+def fbx_header_elements(root, scene_data, time=None):
+    return _original_fbx_header_elements(root, scene_data, CREATION_TIME if time is None else time)
+
+_fbx.fbx_header_elements = fbx_header_elements
+
+# baking samples every frame of every action through the depsgraph, by far the slowest part of exporting characters.
+# The results are plain data and depend only on what _bake_key() hashes, so they are kept for the session.
+MAX_BAKED_ANIMATIONS = 32
+_baked_animations = OrderedDict() # key -> result of fbx_animations_do(), least recently used first
+_NOT_BAKED = object()
+
+# with bake_anim_use_all_actions each action is baked on its own, so save_single() can hand them out to background
+# Blender processes, see bake(). Their results are kept for the latest request only.
+_prebaked = (None, {}) # (key of the request, _bake_key() -> result of fbx_animations_do())
+_bake_actions = None # names of the actions a bake worker bakes, None outside of bake workers
+_bake_results = {} # what a bake worker baked by _bake_key()
+
+class _BakeDone(Exception):
+    '''Ends the export of a bake worker once the animations are baked.'''
+    pass
+
+def _fingerprint_action(fp: Fingerprint, action):
+    if action is None:
+        fp.value(None)
+        return
+    fp.value(action.name)
+    for fcurve in action.fcurves:
+        fp.value((fcurve.data_path, fcurve.array_index, fcurve.extrapolation, fcurve.mute, len(fcurve.modifiers)))
+        points = fcurve.keyframe_points
+        values = array('f', [0]) * (len(points) * 2)
+        for attr in ('co', 'handle_left', 'handle_right'):
+            points.foreach_get(attr, values)
+            fp.bytes(values.tobytes())
+        fp.value([(p.interpolation, p.easing) for p in points])
+
+def _fingerprint_animation_data(fp: Fingerprint, animation_data, references: list):
+    if animation_data is None:
+        fp.value(None)
+        return
+    fp.rna(animation_data, depth=0)
+    _fingerprint_action(fp, animation_data.action)
+    for driver in animation_data.drivers:
+        fp.value((driver.data_path, driver.array_index, driver.driver.expression))
+        for variable in driver.driver.variables:
+            for target in variable.targets:
+                fp.rna(target, depth=0)
+                if isinstance(target.id, bpy.types.Object):
+                    references.append(target.id)
+    for track in animation_data.nla_tracks:
+        fp.rna(track, depth=0)
+        for strip in track.strips:
+            fp.rna(strip, depth=0)
+            _fingerprint_action(fp, strip.action)
+
+def _constraint_targets(constraints):
+    for constraint in constraints:
+        for attr in ('target', 'pole_target'):
+            target = getattr(constraint, attr, None)
+            if isinstance(target, bpy.types.Object):
+                yield target
+        for target in getattr(constraint, 'targets', ()): # armature constraints
+            if isinstance(target.target, bpy.types.Object):
+                yield target.target
+
+def _fingerprint_constraints(fp: Fingerprint, constraints, references: list):
+    for constraint in constraints:
+        fp.rna(constraint)
+    references.extend(_constraint_targets(constraints))
+
+def _fingerprint_object(fp: Fingerprint, obj, visited: set):
+    # the baked transforms are relative to the parents, so they count as well,
+    # just like the objects that constraints and drivers read from
+    references = []
+    while not obj is None and not obj.name in visited:
+        visited.add(obj.name)
+        fp.value((obj.name, obj.parent_type, obj.parent_bone, obj.rotation_mode))
+        fp.matrix(obj.matrix_basis)
+        fp.matrix(obj.matrix_parent_inverse)
+        _fingerprint_constraints(fp, obj.constraints, references)
+        _fingerprint_animation_data(fp, obj.animation_data, references)
+        shape_keys = getattr(obj.data, 'shape_keys', None)
+        if not shape_keys is None:
+            fp.rna(shape_keys, depth=0)
+            for key in shape_keys.key_blocks:
+                fp.rna(key, depth=0)
+            _fingerprint_animation_data(fp, shape_keys.animation_data, references)
+        if obj.type == 'ARMATURE':
+            for bone in obj.data.bones:
+                fp.rna(bone, depth=0)
+            for pbone in obj.pose.bones:
+                fp.rna(pbone, depth=0)
+                _fingerprint_constraints(fp, pbone.constraints, references)
+        obj = obj.parent
+
+    for other in references:
+        _fingerprint_object(fp, other, visited)
+
+def _bake_key(scene_data, ref_id, f_start, f_end, start_zero, objects, force_keep):
+    '''Hashes all that fbx_animations_do() reads, None for NLA strips which aren't cached.'''
+    if ref_id is None:
+        ref = None
+    elif isinstance(ref_id, tuple): # (object, action) with bake_anim_use_all_actions
+        ref = tuple(id.name for id in ref_id)
+    else:
+        return None
+
+    fp = Fingerprint()
+    scene = scene_data.scene
+    fp.value((scene.name, scene.render.fps, scene.render.fps_base))
+    fp.value((ref, f_start, f_end, start_zero, force_keep))
+    settings = scene_data.settings
+    for name, value in zip(settings._fields, settings):
+        if name == 'media_settings': # paths of the written file, which differ in bake workers
+            continue
+        if isinstance(value, Matrix):
+            fp.matrix(value)
+        elif isinstance(value, (bool, int, float, str, tuple)) or value is None:
+            fp.value((name, value))
+
+    wrappers = scene_data.objects if objects is None else objects
+    fp.value(sorted(ob_obj.key for ob_obj in wrappers))
+    visited = set()
+    for ob_obj in wrappers:
+        if ob_obj.is_object:
+            _fingerprint_object(fp, ob_obj.bdata, visited)
+    return fp.hexdigest()
+
+_original_fbx_animations_do = _fbx.fbx_animations_do
+
+def fbx_animations_do(scene_data, ref_id, f_start, f_end, start_zero, objects=None, force_keep=False):
+    if not _bake_actions is None: # a bake worker only bakes the actions of its share
+        if not isinstance(ref_id, tuple) or not ref_id[1].name in _bake_actions:
+            return None
+        key = _bake_key(scene_data, ref_id, f_start, f_end, start_zero, objects, force_keep)
+        anim = _bake_results[key] = _original_fbx_animations_do(
+            scene_data, ref_id, f_start, f_end, start_zero, objects, force_keep)
+        return anim
+
+    key = _bake_key(scene_data, ref_id, f_start, f_end, start_zero, objects, force_keep)
+    if key is None:
+        return _original_fbx_animations_do(scene_data, ref_id, f_start, f_end, start_zero, objects, force_keep)
+
+    anim = _baked_animations.pop(key, _NOT_BAKED)
+    if anim is _NOT_BAKED:
+        anim = _prebaked[1].get(key, _NOT_BAKED)
+    if anim is _NOT_BAKED:
+        anim = _original_fbx_animations_do(scene_data, ref_id, f_start, f_end, start_zero, objects, force_keep)
+    _baked_animations[key] = anim
+    while len(_baked_animations) > MAX_BAKED_ANIMATIONS:
+        _baked_animations.popitem(last=False)
+    return anim
+
+_fbx.fbx_animations_do = fbx_animations_do
+
+_original_fbx_animations = _fbx.fbx_animations
+
+def fbx_animations(scene_data):
+    animations = _original_fbx_animations(scene_data)
+    if not _bake_actions is None:
+        raise _BakeDone() # the file of a bake worker isn't needed
+    return animations
+
+_fbx.fbx_animations = fbx_animations
+
+def _bake_request(scene, kwargs: dict) -> dict:
+    '''The arguments of save_single() as JSON for bake workers, objects are passed by name.'''
+    options, matrices, sets = {}, [], []
+    for name, value in kwargs.items():
+        if isinstance(value, Matrix):
+            options[name] = [list(row) for row in value]
+            matrices.append(name)
+        elif isinstance(value, (set, frozenset)):
+            options[name] = sorted(value)
+            sets.append(name)
+        elif isinstance(value, (bool, int, float, str)) or value is None:
+            options[name] = value
+    objects = kwargs.get('context_objects', None)
+    return {
+        'scene': scene.name,
+        'objects': None if objects is None else [obj.name for obj in objects],
+        'options': options,
+        'matrices': matrices,
+        'sets': sets,
+    }
+
+def _prebake(operator, scene, kwargs: dict, processes: int):
+    global _prebaked
+    actions = [action.name for action in bpy.data.actions]
+    if len(actions) < 2:
+        return
+
+    request = _bake_request(scene, kwargs)
+    fp = Fingerprint().value(request)
+    visited = set()
+    for obj in kwargs.get('context_objects', None) or scene.objects:
+        _fingerprint_object(fp, obj, visited)
+    for action in bpy.data.actions:
+        _fingerprint_action(fp, action)
+    key = fp.hexdigest()
+    if key == _prebaked[0]: # e.g. the same objects for another export-node
+        return
+
+    from .parallel import bake_actions_parallel
+    _prebaked = (key, bake_actions_parallel(operator, request, actions, processes))
+
+def bake(operator, request: dict, actions: list, filepath: str) -> dict:
+    '''
+    Runs in a bake worker: bakes the actions of the save_single() request that parallel.bake_actions_parallel()
+    passed on and returns the results of fbx_animations_do() by _bake_key(). Nothing is written to filepath.
+    '''
+    global _bake_actions
+    kwargs = dict(request['options'])
+    for name in request['matrices']:
+        kwargs[name] = Matrix(kwargs[name])
+    for name in request['sets']:
+        kwargs[name] = set(kwargs[name])
+    if not request['objects'] is None:
+        kwargs['context_objects'] = [bpy.data.objects[name] for name in request['objects']]
+
+    _bake_actions = set(actions)
+    _bake_results.clear()
+    try:
+        save_single(operator, bpy.data.scenes[request['scene']], filepath=filepath, **kwargs)
+    except _BakeDone:
+        pass
+    finally:
+        _bake_actions = None
+    return dict(_bake_results)
+
 def check_skip_material(mat):
     """Simple helper to check whether we actually support exporting that material or not"""
     return mat.type not in {'SURFACE'} # or mat.use_nodes
@@ -64,12 +303,56 @@ HAVOK_SHAPE_NAMES = {
     'CONE': 'Hull', # not supported by Havok
 }
 
+class ObjectAttributes:
+    '''The ME and Havok properties of an object that fbx_data_object_elements() writes, see attribute_table().'''
+    __slots__ = ('scaleDown', 'file', 'highlight', 'rigidBody')
+
+    def __init__(self, obj=None, scaleDown: bool=False):
+        if obj is None: # bones and duplis have none of these
+            self.scaleDown = False
+            self.file = None
+            self.highlight = None
+            self.rigidBody = None
+            return
+
+        d = data(obj)
+        self.scaleDown = obj.type == 'EMPTY' and scaleDown and (
+            (obj.empty_draw_size == 0.5 and obj.empty_draw_type == 'CUBE') or bool(d and d.scaleDown))
+        self.file = d.file if d else None
+        self.highlight = d.highlight_objects if d else None
+
+        rbo = obj.rigid_body
+        self.rigidBody = None if rbo is None else (
+            rbo.mass, rbo.friction, rbo.restitution,
+            HAVOK_SHAPE_NAMES.get(rbo.collision_shape, rbo.collision_shape))
+
+def attribute_table(objects, scaleDown: bool) -> dict:
+    '''Reads the attributes of the objects of one export once, instead of once per object and file.'''
+    return {obj: ObjectAttributes(obj, scaleDown) for obj in objects}
+
+# the table of the running save_single(), objects that are not in it are read as they are written
+_attributes = {}
+_NO_ATTRIBUTES = ObjectAttributes()
+
+def _object_attributes(ob_obj) -> ObjectAttributes:
+    if not ob_obj.is_object or getattr(ob_obj, 'is_dupli', False):
+        return _NO_ATTRIBUTES
+    obj = ob_obj.bdata
+    attributes = _attributes.get(obj, None)
+    if attributes is None:
+        settings = exportSettings()
+        attributes = ObjectAttributes(obj, not settings is None and settings.scaleDown)
+    return attributes
+
 # no easy way to extend, so copied from export_fbx_bin.py and modified
-def fbx_data_object_elements(root, ob_obj, scene_data):
+def fbx_data_object_elements(root, ob_obj, scene_data, attributes: ObjectAttributes = None):
     """
     Write the Object (Model) data blocks.
     Note this "Model" can also be bone or dupli!
     """
+    if attributes is None:
+        attributes = _object_attributes(ob_obj)
+
     obj_type = b"Null"  # default, sort of empty...
     if ob_obj.is_bone:
         obj_type = b"LimbNode"
@@ -93,7 +376,7 @@ def fbx_data_object_elements(root, ob_obj, scene_data):
 
     # ----------------------- CUSTOM PART BEGINS HERE ----------------------- #
 
-    if ob_obj.type == 'EMPTY' and shouldScaleDownEmpty(ob_obj.bdata):
+    if attributes.scaleDown:
         scale = scale * 0.2
 
     # ------------------------ CUSTOM PART ENDS HERE ------------------------ #
@@ -138,21 +421,19 @@ def fbx_data_object_elements(root, ob_obj, scene_data):
         
     # ----------------------- CUSTOM PART BEGINS HERE ----------------------- #
 
-    if obj_type == b"Null" and types.data(ob_obj.bdata):
-        se = types.data(ob_obj.bdata)
-        if se.file:
-            _fbx.elem_props_template_set(tmpl, props, "p_string", b"file", se.file)
-        if se.highlight_objects:
+    if obj_type == b"Null":
+        if attributes.file:
+            _fbx.elem_props_template_set(tmpl, props, "p_string", b"file", attributes.file)
+        if attributes.highlight:
             # TODO SE supports mutliple highlight shapes via <objectname1>;<objectname2>;...
-            _fbx.elem_props_template_set(tmpl, props, "p_string", b"highlight", se.highlight_objects)
+            _fbx.elem_props_template_set(tmpl, props, "p_string", b"highlight", attributes.highlight)
 
-    if obj_type == b"Mesh" and ob_obj.bdata.rigid_body:
-        rbo = ob_obj.bdata.rigid_body
-        shapeType = HAVOK_SHAPE_NAMES[rbo.collision_shape] or rbo.collision_shape
+    if obj_type == b"Mesh" and attributes.rigidBody:
+        mass, friction, restitution, shapeType = attributes.rigidBody
         _fbx.elem_props_template_set(tmpl, props, "p_string", b"hkTypeRigidBody", "hkRigidBody")
-        _fbx.elem_props_template_set(tmpl, props, "p_double", b"mass", rbo.mass)
-        _fbx.elem_props_template_set(tmpl, props, "p_double", b"friction", rbo.friction)
-        _fbx.elem_props_template_set(tmpl, props, "p_double", b"restitution", rbo.restitution)
+        _fbx.elem_props_template_set(tmpl, props, "p_double", b"mass", mass)
+        _fbx.elem_props_template_set(tmpl, props, "p_double", b"friction", friction)
+        _fbx.elem_props_template_set(tmpl, props, "p_double", b"restitution", restitution)
         _fbx.elem_props_template_set(tmpl, props, "p_string", b"hkTypeShape", "hkShape")
         _fbx.elem_props_template_set(tmpl, props, "p_string", b"shapeType", shapeType)
 
@@ -162,14 +443,52 @@ def fbx_data_object_elements(root, ob_obj, scene_data):
 
 _fbx.fbx_data_object_elements = fbx_data_object_elements
 
-def shouldScaleDownEmpty(empty):
-    settings = exportSettings()
-    return not settings is None and settings.scaleDown and (
-               (empty.empty_draw_size == 0.5 and empty.empty_draw_type == 'CUBE') or
-               (data(empty).scaleDown)
-    )
+_FBXElem = _fbx.encode_bin.FBXElem
+
+# the files are only read by MwmBuilder and Havok, they don't need to be small
+def _add_array_uncompressed(self, data, array_type, prop_type):
+    assert(data.typecode == array_type)
+    length = len(data)
+    if _fbx.encode_bin._IS_BIG_ENDIAN:
+        data = data[:]
+        data.byteswap()
+    data = data.tobytes()
+    self.props_type.append(prop_type)
+    self.props.append(pack('<3I', length, 0, len(data)) + data)
+
+@contextmanager
+def _array_compression(array_compression: str):
+    # encode_bin is not cloned, so the user's own FBX exports must get the original back
+    if array_compression != 'NONE':
+        yield
+        return
+    original = _FBXElem._add_array_helper
+    _FBXElem._add_array_helper = _add_array_uncompressed
+    try:
+        yield
+    finally:
+        _FBXElem._add_array_helper = original
 
 # export these two functions as our own so that clients of this module don't have to depend on 
 # the cloned fbx_experimental.export_fbx_bin module
-save_single = _fbx.save_single
+def save_single(operator, scene, filepath="", array_compression='FAST', object_attributes=None, bake_processes=0,
+        **kwargs):
+    '''
+    array_compression 'NONE' writes arrays uncompressed, 'FAST' at zlib's fastest level like Blender does.
+    object_attributes is the attribute_table() of the objects, if it was already read.
+    bake_processes > 1 bakes the actions in that many background Blender processes if all actions are exported.
+    '''
+    global _attributes
+    if bake_processes > 1 and kwargs.get('bake_anim', True) and kwargs.get('bake_anim_use_all_actions', True):
+        _prebake(operator, scene, kwargs, bake_processes)
+    _attributes = object_attributes or {}
+    try:
+        with _array_compression(array_compression):
+            return _fbx.save_single(operator, scene, filepath=filepath, **kwargs)
+    finally:
+        _attributes = {}
+
 save = _fbx.save
+
+# the cloned module itself, fbx_fast.py writes its files with the same element writers
+export_fbx_bin = _fbx
@@ -0,0 +1,432 @@
+'''
+Writes .fbx files for the common case of block models: meshes and empties without animation.
+Mesh data is pulled with foreach_get into NumPy arrays instead of going through the generic exporter that fbx.py clones.
+The generic exporter stays the fallback for everything else, e.g. armatures of characters and animated poses,
+see canWrite(). Models are written by fbx.fbx_data_object_elements() so the ME and Havok properties are the same
+either way. Textures are not referenced, MwmBuilder only cares about the textures in its .xml file.
+
+Writing happens in two steps: describe() reads everything it needs from Blender on the main thread,
+fbx_writer.write() encodes and writes the file without Blender, optionally in a worker process, see save_async().
+'''
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+import hashlib
+import math
+import multiprocessing
+import os
+import sys
+import bpy
+from mathutils import Matrix
+import numpy as np
+
+from .fbx import export_fbx_bin as _bin, fbx_data_object_elements, CREATION_TIME
+from . import fbx_writer, mesh_cache
+from .manifest import Fingerprint
+
+WRITABLE_TYPES = {'MESH', 'EMPTY'}
+
+CREATOR = "Blender (Medieval Engineers FBX)"
+# same as the generic exporter, fbx_writer.write() writes it as it is
+FILE_ID = b"\x28\xb3\x2a\xeb\xb6\x24\xcc\xc2\xbf\xc8\xb0\x2a\xa9\x2b\xfc\xf1"
+
+_Settings = namedtuple('_Settings', ('global_matrix', 'global_matrix_inv', 'bake_space_transform', 'use_custom_props'))
+_SceneData = namedtuple('_SceneData', ('scene', 'settings', 'templates'))
+
+def _uuid(*key) -> int:
+    '''Ids derived from names keep the files of unchanged models byte-identical, the artifact cache relies on that.'''
+    digest = hashlib.sha1('\0'.join(key).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little') & 0x7fffffffffffffff or 1
+
+def _objects(objects, object_types) -> list:
+    if 'OTHER' in object_types:
+        object_types = object_types | _bin.BLENDER_OTHER_OBJECT_TYPES
+    return [o for o in objects if o.type in object_types]
+
+def _isSimple(obj, useModifiers: bool) -> bool:
+    if not obj.type in WRITABLE_TYPES or obj.parent_type != 'OBJECT' or obj.instance_type != 'NONE':
+        return False
+    if obj.type == 'MESH':
+        if len(obj.data.vertex_colors) > 0:
+            return False
+        if not useModifiers and obj.data.shape_keys:
+            return False
+        if any(m.type == 'ARMATURE' for m in obj.modifiers):
+            return False
+    return True
+
+def canWrite(fbxSettings: dict) -> bool:
+    '''Tells if the settings and objects of an export are simple enough for save_single() of this module.'''
+    s = fbxSettings
+    if (s['version'] != 'BIN7400' or s['bake_anim'] or s['use_tspace'] or s['use_mesh_edges']
+            or s['use_custom_props'] or s['mesh_smooth_type'] != 'OFF'
+            or s.get('apply_scale_options', 'FBX_SCALE_NONE') != 'FBX_SCALE_NONE'):
+        return False
+    return all(_isSimple(o, s['use_mesh_modifiers']) for o in _objects(s['context_objects'], s['object_types']))
+
+def hasInstances(fbxSettings: dict) -> bool:
+    '''Tells if some objects of the export share their mesh and might share a Geometry, see describe().'''
+    meshes = [o.data for o in _objects(fbxSettings['context_objects'], fbxSettings['object_types']) if o.type == 'MESH']
+    return len(set(meshes)) < len(meshes)
+
+class _Object:
+    '''Stands in for the ObjectWrapper of the generic exporter, with just what fbx_data_object_elements() needs.'''
+    __slots__ = ('bdata', 'name', 'type', 'fbx_uuid', 'parent', 'hide', 'is_object', 'is_bone', 'materials')
+
+    def __init__(self, obj, parent):
+        self.bdata = obj
+        self.name = obj.name
+        self.type = obj.type
+        self.fbx_uuid = _uuid('Model', obj.name)
+        self.parent = parent # the parent if it is exported as well
+        self.hide = obj.hide_viewport
+        self.is_object = True
+        self.is_bone = False
+        self.materials = list(OrderedDict.fromkeys(
+            slot.material for slot in obj.material_slots if not slot.material is None))
+
+    def fbx_object_tx(self, scene_data):
+        settings = scene_data.settings
+        matrix = self.bdata.matrix_world if self.parent is None else self.bdata.matrix_local
+        if settings.bake_space_transform:
+            # the global matrix is baked into the mesh data, see _geometry()
+            matrix = settings.global_matrix @ matrix @ settings.global_matrix_inv
+        elif self.parent is None:
+            matrix = settings.global_matrix @ matrix
+        loc, rot, scale = matrix.decompose()
+        return loc, rot.to_euler('XYZ'), scale, matrix, rot.to_matrix()
+
+def _geometry(ob: _Object, settings: _Settings, depsgraph, useModifiers: bool) -> dict:
+    '''
+    The mesh of an object as arrays in FBX space, see fbx_writer.geometry_elements().
+    The arrays in object space are kept by mesh_cache until the object changes, so that exports only
+    read a mesh once and differ by the global matrix alone.
+    '''
+    geom = mesh_cache.objectValue(ob.bdata, ('fbx_fast.mesh', useModifiers), lambda: _mesh(ob, depsgraph, useModifiers))
+
+    if settings.bake_space_transform:
+        geom = dict(geom)
+        m = np.array(settings.global_matrix)
+        geom['vertices'] = geom['vertices'] @ m[:3, :3].T + m[:3, 3]
+        # normals go through the inverse transpose without translation and scale
+        n = np.array(settings.global_matrix_inv.transposed().to_3x3())
+        n /= np.linalg.norm(n, axis=0)
+        geom['normals'] = geom['normals'] @ n.T
+
+    return geom
+
+def _instanceKey(ob: _Object, useModifiers: bool) -> tuple:
+    '''
+    Objects with the same key get the same Geometry: they share their mesh, materials and modifier stack.
+    None if the mesh of the object can't be shared because its modifiers refer to other objects.
+    '''
+    obj = ob.bdata
+    modifiers = obj.modifiers if useModifiers else ()
+    stack = Fingerprint()
+    for m in modifiers:
+        if any(p.type == 'POINTER' and isinstance(getattr(m, p.identifier), bpy.types.Object) for p in m.bl_rna.properties):
+            return None
+        stack.rna(m)
+    # per slot, because the material indices of the polygons refer to the slots
+    materials = tuple(s.material.name if s.material else None for s in obj.material_slots)
+    return (obj.data.name, stack.hexdigest(), materials, tuple(g.name for g in obj.vertex_groups))
+
+def _mesh(ob: _Object, depsgraph, useModifiers: bool) -> dict:
+    obj = ob.bdata
+    owner = obj.evaluated_get(depsgraph) if useModifiers else None
+    mesh = owner.to_mesh() if useModifiers else obj.data
+    try:
+        nloops, npolys = len(mesh.loops), len(mesh.polygons)
+        co = np.empty(len(mesh.vertices) * 3, np.float32)
+        mesh.vertices.foreach_get('co', co)
+        co = co.reshape(-1, 3).astype(np.float64)
+        vertexIndices = np.empty(nloops, np.int32)
+        mesh.loops.foreach_get('vertex_index', vertexIndices)
+        edgeIndices = np.empty(nloops, np.int32)
+        mesh.loops.foreach_get('edge_index', edgeIndices)
+        loopStarts = np.empty(npolys, np.int32)
+        mesh.polygons.foreach_get('loop_start', loopStarts)
+        loopTotals = np.empty(npolys, np.int32)
+        mesh.polygons.foreach_get('loop_total', loopTotals)
+        materialIndices = np.empty(npolys, np.int32)
+        mesh.polygons.foreach_get('material_index', materialIndices)
+
+        mesh.calc_normals_split()
+        normals = np.empty(nloops * 3, np.float32)
+        mesh.loops.foreach_get('normal', normals)
+        mesh.free_normals_split()
+        normals = normals.reshape(-1, 3).astype(np.float64)
+
+        uvLayers = []
+        for layer in mesh.uv_layers:
+            uv = np.empty(nloops * 2, np.float32)
+            layer.data.foreach_get('uv', uv)
+            uvLayers.append((layer.name, uv))
+    finally:
+        if not owner is None:
+            owner.to_mesh_clear()
+
+    # the last index of a polygon is stored negated
+    polygonVertices = vertexIndices.copy()
+    if npolys > 0:
+        polygonVertices[loopStarts + loopTotals - 1] ^= -1
+    # an edge is referenced by the first polygon-vertex it starts at
+    _, firstLoops = np.unique(edgeIndices, return_index=True)
+
+    # uv coordinates are shared between the polygons of a vertex if they are the same
+    uvs = []
+    for name, uv in uvLayers:
+        keys = np.empty(nloops, [('u', np.float64), ('v', np.float64), ('vertex', np.int32)])
+        keys['u'] = uv[0::2]
+        keys['v'] = uv[1::2]
+        keys['vertex'] = vertexIndices
+        unique, index = np.unique(keys, return_inverse=True)
+        uvs.append((name, np.stack((unique['u'], unique['v']), axis=1), index))
+
+    # material indices refer to the materials in the order they are connected to the model
+    materials = None
+    if len(ob.materials) > 1:
+        fbxIndex = {m: i for i, m in enumerate(ob.materials)}
+        slots = np.array([fbxIndex.get(slot.material, 0) for slot in obj.material_slots], np.int32)
+        materials = np.where(materialIndices < len(slots), slots[np.minimum(materialIndices, len(slots) - 1)], 0)
+
+    return {
+        'uuid': _uuid('Geometry', obj.name),
+        'name': obj.data.name,
+        'vertices': co,
+        'polygonVertices': polygonVertices,
+        'edges': np.sort(firstLoops),
+        'normals': normals,
+        'uvLayers': uvs,
+        'nbrMaterials': len(ob.materials),
+        'materials': materials,
+    }
+
+# ---------------------------------------------------- elements ---------------------------------------------------- #
+
+def _header_elements(root, scene, axes: tuple, unitScale: float):
+    t = CREATION_TIME
+    header = _bin.elem_empty(root, b"FBXHeaderExtension")
+    _bin.elem_data_single_int32(header, b"FBXHeaderVersion", _bin.FBX_HEADER_VERSION)
+    _bin.elem_data_single_int32(header, b"FBXVersion", _bin.FBX_VERSION)
+    _bin.elem_data_single_int32(header, b"EncryptionType", 0)
+    stamp = _bin.elem_empty(header, b"CreationTimeStamp")
+    _bin.elem_data_single_int32(stamp, b"Version", 1000)
+    for name, value in ((b"Year", t.year), (b"Month", t.month), (b"Day", t.day), (b"Hour", t.hour),
+                        (b"Minute", t.minute), (b"Second", t.second), (b"Millisecond", t.microsecond // 1000)):
+        _bin.elem_data_single_int32(stamp, name, value)
+    _bin.elem_data_single_string_unicode(header, b"Creator", CREATOR)
+
+    _bin.elem_data_single_bytes(root, b"FileId", FILE_ID)
+    _bin.elem_data_single_string(root, b"CreationTime", "{:04}-{:02}-{:02} {:02}:{:02}:{:02}:{:03}".format(
+        t.year, t.month, t.day, t.hour, t.minute, t.second, t.microsecond // 1000).encode())
+    _bin.elem_data_single_string_unicode(root, b"Creator", CREATOR)
+
+    globalSettings = _bin.elem_empty(root, b"GlobalSettings")
+    _bin.elem_data_single_int32(globalSettings, b"Version", 1000)
+    props = _bin.elem_properties(globalSettings)
+    upAxis, frontAxis, coordAxis = _bin.RIGHT_HAND_AXES[axes]
+    _bin.elem_props_set(props, "p_integer", b"UpAxis", upAxis[0])
+    _bin.elem_props_set(props, "p_integer", b"UpAxisSign", upAxis[1])
+    _bin.elem_props_set(props, "p_integer", b"FrontAxis", frontAxis[0])
+    _bin.elem_props_set(props, "p_integer", b"FrontAxisSign", frontAxis[1])
+    _bin.elem_props_set(props, "p_integer", b"CoordAxis", coordAxis[0])
+    _bin.elem_props_set(props, "p_integer", b"CoordAxisSign", coordAxis[1])
+    _bin.elem_props_set(props, "p_integer", b"OriginalUpAxis", -1)
+    _bin.elem_props_set(props, "p_integer", b"OriginalUpAxisSign", 1)
+    _bin.elem_props_set(props, "p_double", b"UnitScaleFactor", unitScale)
+    _bin.elem_props_set(props, "p_double", b"OriginalUnitScaleFactor", unitScale)
+    _bin.elem_props_set(props, "p_color_rgb", b"AmbientColor", (0.0, 0.0, 0.0))
+    _bin.elem_props_set(props, "p_string", b"DefaultCamera", "Producer Perspective")
+    fps = scene.render.fps / scene.render.fps_base
+    mode = next((mode for ref, mode in _bin.FBX_FRAMERATES if math.isclose(ref, fps, rel_tol=1e-6)),
+                _bin.FBX_FRAMERATES[0][1])
+    _bin.elem_props_set(props, "p_enum", b"TimeMode", mode)
+    _bin.elem_props_set(props, "p_timestamp", b"TimeSpanStart", 0)
+    _bin.elem_props_set(props, "p_timestamp", b"TimeSpanStop", _bin.FBX_KTIME)
+    _bin.elem_props_set(props, "p_double", b"CustomFrameRate", fps)
+
+def _document_elements(root, scene):
+    docs = _bin.elem_empty(root, b"Documents")
+    _bin.elem_data_single_int32(docs, b"Count", 1)
+    doc = _bin.elem_data_single_int64(docs, b"Document", _uuid('Document', scene.name))
+    doc.add_string_unicode(scene.name)
+    doc.add_string_unicode(scene.name)
+    props = _bin.elem_properties(doc)
+    _bin.elem_props_set(props, "p_object", b"SourceObject")
+    _bin.elem_props_set(props, "p_string", b"ActiveAnimStackName", "")
+    _bin.elem_data_single_int64(doc, b"RootNode", 0)
+
+    _bin.elem_empty(root, b"References")
+
+def _templates(scene, settings, nbrEmpties: int, nbrMeshes: int, nbrObjects: int, nbrMaterials: int) -> OrderedDict:
+    templates = OrderedDict()
+    templates[b"GlobalSettings"] = _bin.fbx_template_def_globalsettings(scene, settings, nbr_users=1)
+    if nbrEmpties > 0:
+        templates[b"Null"] = _bin.fbx_template_def_null(scene, settings, nbr_users=nbrEmpties)
+    if nbrMeshes > 0:
+        templates[b"Geometry"] = _bin.fbx_template_def_geometry(scene, settings, nbr_users=nbrMeshes)
+    if nbrObjects > 0:
+        templates[b"Model"] = _bin.fbx_template_def_model(scene, settings, nbr_users=nbrObjects)
+    if nbrMaterials > 0:
+        templates[b"Material"] = _bin.fbx_template_def_material(scene, settings, nbr_users=nbrMaterials)
+    return templates
+
+def _definition_elements(root, templates: OrderedDict):
+    definitions = _bin.elem_empty(root, b"Definitions")
+    _bin.elem_data_single_int32(definitions, b"Version", _bin.FBX_TEMPLATES_VERSION)
+    _bin.elem_data_single_int32(definitions, b"Count", sum(t.nbr_users for t in templates.values()))
+    _bin.fbx_templates_generate(definitions, templates)
+
+def _null_elements(root, ob: _Object, scene_data):
+    null = _bin.elem_data_single_int64(root, b"NodeAttribute", _uuid('NodeAttribute', ob.name))
+    null.add_string(_bin.fbx_name_class(ob.name.encode(), b"NodeAttribute"))
+    null.add_string(b"Null")
+    _bin.elem_data_single_string(null, b"TypeFlags", b"Null")
+    tmpl = _bin.elem_props_template_init(scene_data.templates, b"Null")
+    props = _bin.elem_properties(null)
+    _bin.elem_props_template_finalize(tmpl, props)
+
+def _material_elements(root, mat, scene_data):
+    elem = _bin.elem_data_single_int64(root, b"Material", _uuid('Material', mat.name))
+    elem.add_string(_bin.fbx_name_class(mat.name.encode(), b"Material"))
+    elem.add_string(b"")
+    _bin.elem_data_single_int32(elem, b"Version", _bin.FBX_MATERIAL_VERSION)
+    _bin.elem_data_single_string(elem, b"ShadingModel", b"Phong")
+    _bin.elem_data_single_int32(elem, b"MultiLayer", 0)
+    tmpl = _bin.elem_props_template_init(scene_data.templates, b"Material")
+    props = _bin.elem_properties(elem)
+    _bin.elem_props_template_set(tmpl, props, "p_string", b"ShadingModel", "Phong")
+    _bin.elem_props_template_set(tmpl, props, "p_color", b"DiffuseColor", tuple(mat.diffuse_color[:3]))
+    _bin.elem_props_template_finalize(tmpl, props)
+
+def describe(operator, scene, filepath="",
+             global_matrix=Matrix(),
+             apply_unit_scale=False,
+             global_scale=1.0,
+             axis_up='Y',
+             axis_forward='Z',
+             context_objects=(),
+             object_types=None,
+             use_mesh_modifiers=True,
+             bake_space_transform=False,
+             array_compression='FAST',
+             use_instancing=False,
+             object_attributes=None,
+             **kwargs) -> dict:
+    '''
+    Reads what fbx_writer.write() needs from Blender. Everything but the geometries is already turned into elements.
+    Takes the same arguments as fbx.save_single(), those that canWrite() rules out are ignored.
+    With use_instancing objects that share their mesh also share one Geometry, see _instanceKey().
+    '''
+    # like the generic exporter with its default apply_scale_options='FBX_SCALE_NONE'
+    unitScale = _bin.units_blender_to_fbx_factor(scene) if apply_unit_scale else 100.0
+    global_matrix = Matrix.Scale(unitScale * global_scale, 4) @ global_matrix
+    settings = _Settings(global_matrix, global_matrix.inverted_safe(), bake_space_transform, False)
+
+    blobjects = _objects(context_objects, object_types or WRITABLE_TYPES)
+    exported = set(blobjects)
+    objects = [_Object(o, o.parent if o.parent in exported else None) for o in blobjects]
+    empties = [ob for ob in objects if ob.type == 'EMPTY']
+
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    geometries = [] # (object, geometry) for every mesh object, several objects can have the same geometry
+    instances = {}
+    for ob in objects:
+        if ob.type != 'MESH':
+            continue
+        key = _instanceKey(ob, use_mesh_modifiers) if use_instancing else None
+        geom = instances.get(key, None) if not key is None else None
+        if geom is None:
+            geom = _geometry(ob, settings, depsgraph, use_mesh_modifiers)
+            if not key is None:
+                instances[key] = geom
+        geometries.append((ob, geom))
+    unique = list(OrderedDict((id(geom), geom) for ob, geom in geometries).values())
+    materials = list(OrderedDict.fromkeys(m for ob in objects for m in ob.materials))
+
+    templates = _templates(scene, settings, len(empties), len(unique), len(objects), len(materials))
+    scene_data = _SceneData(scene, settings, templates)
+
+    root = _bin.elem_empty(None, b"")
+    _header_elements(root, scene, (axis_up, axis_forward), 1.0)
+    _document_elements(root, scene)
+    _definition_elements(root, templates)
+
+    # the geometries are added in front of the models by fbx_writer.write()
+    elements = _bin.elem_empty(root, b"Objects")
+    for ob in empties:
+        _null_elements(elements, ob, scene_data)
+    object_attributes = object_attributes or {}
+    for ob in objects:
+        fbx_data_object_elements(elements, ob, scene_data, object_attributes.get(ob.bdata, None))
+    for mat in materials:
+        _material_elements(elements, mat, scene_data)
+
+    connections = _bin.elem_empty(root, b"Connections")
+    for ob in objects:
+        parent = 0 if ob.parent is None else _uuid('Model', ob.parent.name)
+        _bin.elem_connection(connections, b"OO", ob.fbx_uuid, parent)
+    for ob in empties:
+        _bin.elem_connection(connections, b"OO", _uuid('NodeAttribute', ob.name), ob.fbx_uuid)
+    for ob, geom in geometries:
+        _bin.elem_connection(connections, b"OO", geom['uuid'], ob.fbx_uuid)
+    for ob in objects:
+        for mat in ob.materials:
+            _bin.elem_connection(connections, b"OO", _uuid('Material', mat.name), ob.fbx_uuid)
+
+    takes = _bin.elem_empty(root, b"Takes")
+    _bin.elem_data_single_string(takes, b"Current", b"")
+
+    return {
+        'filepath': filepath,
+        'version': _bin.FBX_VERSION,
+        'root': fbx_writer.plain(root),
+        'geometries': unique,
+        'compressArrays': array_compression != 'NONE',
+    }
+
+def save_single(operator, scene, filepath="", **kwargs):
+    fbx_writer.write(describe(operator, scene, filepath, **kwargs))
+    return {'FINISHED'}
+
+# ------------------------------------------------- worker processes ------------------------------------------------- #
+
+# runs in a worker, which has Blender's Python but no bpy, so fbx_writer is imported as a top-level module
+_WORKER_CODE = '''
+import sys
+if not DIRECTORY in sys.path:
+    sys.path.append(DIRECTORY)
+import fbx_writer
+fbx_writer.write(FILE)
+'''
+
+_pool = None
+_poolSize = 0
+
+def _writerPool(processes: int) -> ProcessPoolExecutor:
+    global _pool, _poolSize
+    if _pool is None or _poolSize != processes:
+        shutdown()
+        context = multiprocessing.get_context('spawn')
+        # sys.executable is Blender itself, at least up to Blender 2.90
+        context.set_executable(getattr(bpy.app, 'binary_path_python', sys.executable))
+        _pool = ProcessPoolExecutor(processes, mp_context=context)
+        _poolSize = processes
+    return _pool
+
+def save_async(processes: int, operator, scene, filepath="", **kwargs) -> Future:
+    '''
+    Reads the data for the file right away and writes it in one of a pool of worker processes that is kept
+    between exports. The returned future is done once the file is complete.
+    '''
+    file = describe(operator, scene, filepath, **kwargs)
+    # exec is pickled by name and the arguments are plain data, so the worker never imports the add-on itself
+    return _writerPool(processes).submit(exec, _WORKER_CODE, {'DIRECTORY': os.path.dirname(__file__), 'FILE': file})
+
+def shutdown():
+    '''Stops the worker processes, e.g. when the add-on is unregistered.'''
+    global _pool, _poolSize
+    if not _pool is None:
+        _pool.shutdown(wait=True)
+        _pool = None
+        _poolSize = 0
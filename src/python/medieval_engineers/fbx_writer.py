@@ -0,0 +1,218 @@
+'''
+Encodes and writes the .fbx files described by fbx_fast.describe(). Only depends on the standard library and NumPy,
+so it also runs in worker processes of Blender's Python that have no bpy, see fbx_fast.save_async().
+The description is plain data so that it can be pickled without importing the add-on:
+elements are (id, props, props_type, children) tuples and geometries are dicts of arrays.
+'''
+from struct import pack
+import zlib
+import numpy as np
+
+# as in io_scene_fbx/fbx_utils.py
+FBX_GEOMETRY_VERSION = 124
+FBX_GEOMETRY_NORMAL_VERSION = 101
+FBX_GEOMETRY_UV_VERSION = 101
+FBX_GEOMETRY_MATERIAL_VERSION = 101
+FBX_GEOMETRY_LAYER_VERSION = 100
+
+_HEAD_MAGIC = b'Kaydara FBX Binary\x20\x20\x00\x1a\x00'
+_FOOT_ID = b'\xfa\xbc\xab\x09\xd0\xc8\xd4\x66\xb1\x76\xfb\x83\x1c\xf7\x26\x7e'
+_FOOT_MAGIC = b'\xf8\x5a\x8c\x6a\xde\xf5\xd9\x7e\xec\xe9\x0c\xe3\x75\x8f\x29\x0b'
+_BLOCK_SENTINEL = b'\0' * 13
+
+class Element:
+    '''
+    Same layout as io_scene_fbx.encode_bin.FBXElem: props holds the packed values and props_type their type-codes.
+    Arrays are compressed when they are added, which is the expensive part of writing a file.
+    '''
+    __slots__ = ('id', 'props', 'props_type', 'elems', '_end_offset', '_props_length')
+
+    def __init__(self, id: bytes, props=None, props_type=b'', elems=None):
+        self.id = id
+        self.props = [] if props is None else props
+        self.props_type = bytearray(props_type)
+        self.elems = [] if elems is None else elems
+        self._end_offset = -1
+        self._props_length = -1
+
+    @classmethod
+    def of(cls, plain: tuple) -> 'Element':
+        id, props, props_type, elems = plain
+        return cls(id, list(props), props_type, [cls.of(e) for e in elems])
+
+    def _add(self, type: bytes, data: bytes):
+        self.props_type += type
+        self.props.append(data)
+
+    def add_int32(self, value: int):
+        self._add(b'I', pack('<i', value))
+
+    def add_int64(self, value: int):
+        self._add(b'L', pack('<q', value))
+
+    def add_float64(self, value: float):
+        self._add(b'D', pack('<d', value))
+
+    def add_string(self, value: bytes):
+        self._add(b'S', pack('<I', len(value)) + value)
+
+    def add_string_unicode(self, value: str):
+        self.add_string(value.encode('utf-8'))
+
+    def _add_array(self, type: bytes, values: np.ndarray, compress: bool):
+        data = values.tobytes()
+        encoding = 1 if compress and len(data) > 128 else 0 # like Autodesk's FBX converter
+        if encoding != 0:
+            data = zlib.compress(data, 1)
+        self._add(type, pack('<3I', len(values), encoding, len(data)) + data)
+
+    def add_int32_array(self, values, compress=True):
+        self._add_array(b'i', np.ascontiguousarray(values, '<i4').ravel(), compress)
+
+    def add_float64_array(self, values, compress=True):
+        self._add_array(b'd', np.ascontiguousarray(values, '<f8').ravel(), compress)
+
+    def _calc_offsets(self, offset: int, is_last: bool) -> int:
+        offset += 12 + 1 + len(self.id)
+        self._props_length = sum(1 + len(data) for data in self.props)
+        offset += self._props_length
+        offset = self._calc_offsets_children(offset, is_last)
+        self._end_offset = offset
+        return offset
+
+    def _calc_offsets_children(self, offset: int, is_last: bool) -> int:
+        if self.elems:
+            last = self.elems[-1]
+            for elem in self.elems:
+                offset = elem._calc_offsets(offset, elem is last)
+            offset += len(_BLOCK_SENTINEL)
+        elif not self.props and not is_last:
+            offset += len(_BLOCK_SENTINEL)
+        return offset
+
+    def _write(self, write, is_last: bool):
+        write(pack('<3I', self._end_offset, len(self.props), self._props_length))
+        write(bytes((len(self.id),)))
+        write(self.id)
+        for type, data in zip(self.props_type, self.props):
+            write(bytes((type,)))
+            write(data)
+        self._write_children(write, is_last)
+
+    def _write_children(self, write, is_last: bool):
+        if self.elems:
+            last = self.elems[-1]
+            for elem in self.elems:
+                elem._write(write, elem is last)
+            write(_BLOCK_SENTINEL)
+        elif not self.props and not is_last:
+            write(_BLOCK_SENTINEL)
+
+def plain(elem) -> tuple:
+    '''Turns an element built with io_scene_fbx's element writers into plain data.'''
+    return (elem.id, list(elem.props), bytes(elem.props_type), [plain(e) for e in elem.elems])
+
+def element(parent: Element, id: bytes) -> Element:
+    elem = Element(id)
+    parent.elems.append(elem)
+    return elem
+
+def single(parent: Element, id: bytes, add: str, value) -> Element:
+    elem = element(parent, id)
+    getattr(elem, add)(value)
+    return elem
+
+def _array(parent: Element, id: bytes, add: str, values, compress: bool) -> Element:
+    elem = element(parent, id)
+    getattr(elem, add)(values, compress)
+    return elem
+
+def _layer_element(layer: Element, type: bytes, index: int):
+    elem = element(layer, b"LayerElement")
+    single(elem, b"Type", 'add_string', type)
+    single(elem, b"TypedIndex", 'add_int32', index)
+
+def geometry_elements(parent: Element, geom: dict, compress=True):
+    '''
+    Writes the Geometry of a mesh like io_scene_fbx does for meshes without smoothing, tangents and colors.
+    Without compress the arrays are written as they are, which is faster but makes the file larger.
+    '''
+    elem = single(parent, b"Geometry", 'add_int64', geom['uuid'])
+    elem.add_string(geom['name'].encode('utf-8') + b"\x00\x01Geometry")
+    elem.add_string(b"Mesh")
+    element(elem, b"Properties70")
+
+    single(elem, b"GeometryVersion", 'add_int32', FBX_GEOMETRY_VERSION)
+    _array(elem, b"Vertices", 'add_float64_array', geom['vertices'], compress)
+    _array(elem, b"PolygonVertexIndex", 'add_int32_array', geom['polygonVertices'], compress)
+    _array(elem, b"Edges", 'add_int32_array', geom['edges'], compress)
+
+    normals = single(elem, b"LayerElementNormal", 'add_int32', 0)
+    single(normals, b"Version", 'add_int32', FBX_GEOMETRY_NORMAL_VERSION)
+    single(normals, b"Name", 'add_string', b"")
+    single(normals, b"MappingInformationType", 'add_string', b"ByPolygonVertex")
+    single(normals, b"ReferenceInformationType", 'add_string', b"Direct")
+    _array(normals, b"Normals", 'add_float64_array', geom['normals'], compress)
+
+    for i, (name, uvs, index) in enumerate(geom['uvLayers']):
+        uv = single(elem, b"LayerElementUV", 'add_int32', i)
+        single(uv, b"Version", 'add_int32', FBX_GEOMETRY_UV_VERSION)
+        single(uv, b"Name", 'add_string_unicode', name)
+        single(uv, b"MappingInformationType", 'add_string', b"ByPolygonVertex")
+        single(uv, b"ReferenceInformationType", 'add_string', b"IndexToDirect")
+        _array(uv, b"UV", 'add_float64_array', uvs, compress)
+        _array(uv, b"UVIndex", 'add_int32_array', index, compress)
+
+    hasMaterials = geom['nbrMaterials'] > 0
+    if hasMaterials:
+        materials = single(elem, b"LayerElementMaterial", 'add_int32', 0)
+        single(materials, b"Version", 'add_int32', FBX_GEOMETRY_MATERIAL_VERSION)
+        single(materials, b"Name", 'add_string', b"")
+        if geom['materials'] is None:
+            single(materials, b"MappingInformationType", 'add_string', b"AllSame")
+            single(materials, b"ReferenceInformationType", 'add_string', b"IndexToDirect")
+            single(materials, b"Materials", 'add_int32_array', [0])
+        else:
+            single(materials, b"MappingInformationType", 'add_string', b"ByPolygon")
+            single(materials, b"ReferenceInformationType", 'add_string', b"IndexToDirect")
+            _array(materials, b"Materials", 'add_int32_array', geom['materials'], compress)
+
+    layer = single(elem, b"Layer", 'add_int32', 0)
+    single(layer, b"Version", 'add_int32', FBX_GEOMETRY_LAYER_VERSION)
+    _layer_element(layer, b"LayerElementNormal", 0)
+    if geom['uvLayers']:
+        _layer_element(layer, b"LayerElementUV", 0)
+    if hasMaterials:
+        _layer_element(layer, b"LayerElementMaterial", 0)
+    for i in range(1, len(geom['uvLayers'])):
+        layer = single(elem, b"Layer", 'add_int32', i)
+        single(layer, b"Version", 'add_int32', FBX_GEOMETRY_LAYER_VERSION)
+        _layer_element(layer, b"LayerElementUV", i)
+
+def write(file: dict):
+    '''
+    Writes the file described by fbx_fast.describe(). The geometries go in front of the Models in Objects,
+    where io_scene_fbx puts them as well.
+    '''
+    root = Element.of(file['root'])
+    objects = next(e for e in root.elems if e.id == b"Objects")
+    geometries = Element(b"Objects")
+    for geom in file['geometries']:
+        geometry_elements(geometries, geom, file['compressArrays'])
+    index = sum(1 for e in objects.elems if e.id == b"NodeAttribute")
+    objects.elems[index:index] = geometries.elems
+
+    version = file['version']
+    with open(file['filepath'], 'wb') as f:
+        f.write(_HEAD_MAGIC)
+        f.write(pack('<I', version))
+        root._calc_offsets_children(f.tell(), False)
+        root._write_children(f.write, False)
+        f.write(_FOOT_ID)
+        f.write(b'\0' * 4)
+        # pad to 16 bytes, a whole 16 bytes if already aligned
+        offset = f.tell()
+        f.write(b'\0' * ((((offset + 15) & ~15) - offset) or 16))
+        f.write(pack('<I', version))
+        f.write(b'\0' * 120)
+        f.write(_FOOT_MAGIC)
@@ -0,0 +1,203 @@
+from array import array
+import hashlib
+import json
+import os
+import tempfile
+import bpy
+
+from .types import data
+from . import mesh_cache
+
+MANIFEST_NAME = '.medieval_engineers.manifest.json'
+
+_SCALAR_TYPES = {'BOOLEAN', 'INT', 'FLOAT', 'STRING', 'ENUM'}
+
+def _plain(value):
+    # the repr of bpy arrays shows their data-path instead of their values
+    if isinstance(value, set):
+        return tuple(sorted(value))
+    if isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return value
+    try:
+        return tuple(_plain(v) for v in value)
+    except TypeError:
+        return value
+
+class Fingerprint:
+    '''
+    Hashes everything that goes into an exported file without actually exporting it.
+    A fingerprint is cheap compared to an FBX export but only as exact as the data fed into it:
+    changes to data it doesn't look at (e.g. objects referenced by modifiers) go unnoticed.
+    '''
+
+    def __init__(self):
+        self.hash = hashlib.sha256()
+
+    def value(self, value):
+        self.hash.update(repr(value).encode('utf-8'))
+        self.hash.update(b'\0')
+        return self
+
+    def bytes(self, value: bytes):
+        self.hash.update(value)
+        self.hash.update(b'\0')
+        return self
+
+    def rna(self, struct, depth=1):
+        '''Hashes all scalar properties of a bpy struct, ID-pointers by name and nested property-groups up to depth.'''
+        if struct is None:
+            return self.value(None)
+
+        for prop in struct.bl_rna.properties:
+            id = prop.identifier
+            if id == 'rna_type':
+                continue
+            if prop.type in _SCALAR_TYPES:
+                self.value((id, _plain(getattr(struct, id))))
+            elif prop.type == 'POINTER':
+                value = getattr(struct, id)
+                if isinstance(value, bpy.types.ID):
+                    self.value((id, value.name))
+                elif depth > 0 and not value is None:
+                    self.value(id)
+                    self.rna(value, depth-1)
+        return self
+
+    def matrix(self, matrix):
+        return self.value(_plain(matrix))
+
+    def mesh(self, mesh):
+        '''Hashes the digest of the mesh's data, which is kept by mesh_cache until the mesh changes.'''
+        return self.bytes(mesh_cache.meshValue(mesh, 'manifest.digest', lambda: Fingerprint()._mesh(mesh).hash.digest()))
+
+    def _mesh(self, mesh):
+        self.rna(mesh, depth=0)
+
+        def raw(collection, attr, typecode, width=1):
+            values = array(typecode, [0]) * (len(collection) * width)
+            collection.foreach_get(attr, values)
+            self.bytes(values.tobytes())
+
+        raw(mesh.vertices, 'co', 'f', 3)
+        raw(mesh.edges, 'vertices', 'i', 2)
+        raw(mesh.loops, 'vertex_index', 'i')
+        raw(mesh.polygons, 'loop_start', 'i')
+        raw(mesh.polygons, 'material_index', 'i')
+        self.value([p.use_smooth for p in mesh.polygons])
+        self.value([e.use_edge_sharp for e in mesh.edges])
+        for layer in mesh.uv_layers:
+            self.value(layer.name)
+            raw(layer.data, 'uv', 'f', 2)
+        for layer in mesh.vertex_colors:
+            self.value(layer.name)
+            raw(layer.data, 'color', 'f', 4)
+        return self
+
+    def material(self, mat):
+        self.value(mat.name)
+        self.rna(mat, depth=0)
+        self.rna(data(mat))
+        return self
+
+    def object(self, obj):
+        self.value((obj.name, obj.type, obj.parent.name if obj.parent else None))
+        self.matrix(obj.matrix_world)
+        self.rna(data(obj))
+        self.rna(obj.rigid_body)
+        for attr in ('empty_display_type', 'empty_display_size', 'empty_draw_type', 'empty_draw_size'):
+            if hasattr(obj, attr):
+                self.value((attr, getattr(obj, attr)))
+        for modifier in obj.modifiers:
+            self.rna(modifier)
+        for slot in obj.material_slots:
+            self.value(slot.link)
+            if slot.material is None:
+                self.value(None)
+            else:
+                self.material(slot.material)
+        if isinstance(obj.data, bpy.types.Mesh):
+            self.mesh(obj.data)
+        return self
+
+    def objects(self, objects):
+        for obj in sorted(objects, key=lambda o: o.name):
+            self.object(obj)
+        return self
+
+    def hexdigest(self) -> str:
+        return self.hash.hexdigest()
+
+class ExportManifest:
+    '''
+    Remembers the fingerprints of the files that were successfully exported into an output directory.
+    A file whose fingerprint didn't change since then doesn't need to be exported again.
+    Several exports may share an output directory, so save() only writes back the entries this manifest changed.
+    '''
+
+    def __init__(self, outputDir: str):
+        self.outputDir = outputDir
+        self.file = os.path.join(outputDir, MANIFEST_NAME)
+        self.entries = self._load()
+        self.changes = {} # key -> new fingerprint, None for discarded entries
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.changes)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except (OSError, ValueError): # missing or broken, start over
+            return {}
+
+    def _key(self, file: str) -> str:
+        return os.path.relpath(file, self.outputDir)
+
+    def isClean(self, file: str, fingerprint: str) -> bool:
+        return self.entries.get(self._key(file), None) == fingerprint and os.path.isfile(file)
+
+    def update(self, file: str, fingerprint: str):
+        key = self._key(file)
+        if self.entries.get(key, None) != fingerprint:
+            self.entries[key] = fingerprint
+            self.changes[key] = fingerprint
+
+    def discard(self, file: str):
+        key = self._key(file)
+        if self.entries.pop(key, None) is not None:
+            self.changes[key] = None
+
+    def commit(self, outcomes: dict, fingerprints: dict):
+        '''Records the fingerprints of all files that were exported successfully, forgets the ones that failed.'''
+        for file, fingerprint in fingerprints.items():
+            outcome = outcomes.get(file, None)
+            if outcome == 'SUCCESS':
+                self.update(file, fingerprint)
+            elif outcome != 'UNCHANGED':
+                self.discard(file)
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(self.outputDir, exist_ok=True)
+
+        # merge with what other exports saved in the meantime
+        entries = self._load()
+        for key, fingerprint in self.changes.items():
+            if fingerprint is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = fingerprint
+
+        fd, tmpfile = tempfile.mkstemp(prefix=MANIFEST_NAME + '.', suffix='.tmp', dir=self.outputDir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, indent=1, sort_keys=True)
+            os.replace(tmpfile, self.file)
+        except BaseException:
+            os.remove(tmpfile)
+            raise
+        self.entries = entries
+        self.changes.clear()
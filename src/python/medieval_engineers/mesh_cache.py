@@ -0,0 +1,98 @@
+'''
+Keeps values that are expensive to derive from meshes, like the mesh arrays of fbx_fast or the hashes of manifest,
+for the whole Blender session. A depsgraph_update_post handler drops the values of an object or mesh as soon as
+its data changes, so repeated exports only read the meshes that were changed in between.
+Values are looked up by name and must be computed and used on the main thread.
+'''
+from collections import defaultdict
+import bpy
+from bpy.app.handlers import persistent
+
+_objects = {} # object name -> {key: value}
+_meshes = {} # mesh name -> {key: value}
+_users = defaultdict(set) # mesh name -> names of the objects with values derived from it
+_revision = 0 # counts the updates, see revision()
+
+def revision() -> int:
+    '''Changes with every update of the depsgraph. Values derived from a whole scene can be kept per revision.'''
+    return _revision
+
+def objectValue(obj, key, compute):
+    '''Returns compute() for the key, computed once per object until it or its mesh changes.'''
+    values = _objects.get(obj.name, None)
+    if values is None:
+        values = _objects[obj.name] = {}
+        if isinstance(obj.data, bpy.types.Mesh):
+            _users[obj.data.name].add(obj.name)
+    value = values.get(key, None)
+    if value is None:
+        value = values[key] = compute()
+    return value
+
+def meshValue(mesh, key, compute):
+    '''Returns compute() for the key, computed once per mesh until it changes.'''
+    values = _meshes.get(mesh.name, None)
+    if values is None:
+        values = _meshes[mesh.name] = {}
+    value = values.get(key, None)
+    if value is None:
+        value = values[key] = compute()
+    return value
+
+def invalidateObject(name: str):
+    _objects.pop(name, None)
+
+def invalidateMesh(name: str):
+    _meshes.pop(name, None)
+    for user in _users.pop(name, ()):
+        _objects.pop(user, None)
+
+def clear():
+    global _revision
+    _revision += 1
+    _objects.clear()
+    _meshes.clear()
+    _users.clear()
+
+@persistent
+def _depsgraphUpdated(scene, depsgraph=None):
+    if depsgraph is None: # the handler has no depsgraph argument in some versions of Blender
+        clear()
+        return
+
+    global _revision
+    _revision += 1
+    for update in depsgraph.updates:
+        id = update.id.original
+        if isinstance(id, bpy.types.Object):
+            # moving an object doesn't change the mesh arrays, they are in object space
+            if update.is_updated_geometry or update.is_updated_shading or not update.is_updated_transform:
+                invalidateObject(id.name)
+        elif isinstance(id, bpy.types.Mesh):
+            invalidateMesh(id.name)
+
+@persistent
+def _cleared(*args):
+    clear()
+
+# undo and a new frame don't reliably show up as updates of the affected objects
+_HANDLERS = (
+    ('depsgraph_update_post', _depsgraphUpdated),
+    ('frame_change_post', _cleared),
+    ('undo_post', _cleared),
+    ('redo_post', _cleared),
+    ('load_post', _cleared),
+)
+
+def register():
+    for name, handler in _HANDLERS:
+        handlers = getattr(bpy.app.handlers, name)
+        if not handler in handlers:
+            handlers.append(handler)
+
+def unregister():
+    for name, handler in _HANDLERS:
+        handlers = getattr(bpy.app.handlers, name)
+        if handler in handlers:
+            handlers.remove(handler)
+    clear()
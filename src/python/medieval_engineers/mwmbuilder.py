@@ -4,6 +4,7 @@ import bpy
 from xml.etree import ElementTree
 from .texture_files import TextureType
 from .types import data, MEMaterialInfo, rgb
+from .tracing import traced
 import re
 
 
@@ -45,7 +46,30 @@ def _floatstr(f):
 def _material_technique(technique):
     return "ALPHA_MASKED" if "ALPHAMASK" == technique else technique
 
+@traced('material_xml')
 def material_xml(settings, mat, file=None, node=None):
+    '''
+    The element for the material in MwmBuilder's .xml file. It does not depend on the block size,
+    so it is built once per export and reused, along with the problems found while building it.
+    '''
+    key = ('material_xml', mat.name)
+    cached = settings.sharedCache.get(key, None)
+    if cached is None:
+        problems = []
+        cached = settings.sharedCache[key] = (_material_xml(settings, mat, problems), problems)
+    e, problems = cached
+    for problem in problems:
+        settings.error(problem, file=file, node=node)
+    return e
+
+def _material_reference(settings, xmlrefpath: str):
+    key = ('materialref', xmlrefpath)
+    xmlref = settings.sharedCache.get(key, None)
+    if xmlref is None:
+        xmlref = settings.sharedCache[key] = ElementTree.parse(xmlrefpath).getroot()
+    return xmlref
+
+def _material_xml(settings, mat, problems: list):
     d = data(mat)
     e = ElementTree.Element("Material", Name=mat.name)
     m = MEMaterialInfo(mat)
@@ -86,7 +110,7 @@ def material_xml(settings, mat, file=None, node=None):
 
     # load material library file only once
     xmlrefpath = bpy.path.abspath(bpy.context.preferences.addons['medieval_engineers'].preferences.materialref)
-    xmlref = ElementTree.parse(xmlrefpath).getroot()
+    xmlref = _material_reference(settings, xmlrefpath)
 
     for texType in TextureType:
         filepath = m.images.get(texType, None)
@@ -103,9 +127,9 @@ def material_xml(settings, mat, file=None, node=None):
         if filepath is not None:
             derivedPath = derive_texture_path(settings, filepath)
             if (BAD_PATH.search(derivedPath)):
-                settings.error("The %s texture of material '%s' exports with the non-portable path: '%s'. "
-                               "Consult the documentation on texture-paths."
-                               % (texType.name, mat.name, derivedPath), file=file, node=node)
+                problems.append("The %s texture of material '%s' exports with the non-portable path: '%s'. "
+                                "Consult the documentation on texture-paths."
+                                % (texType.name, mat.name, derivedPath))
             param(texType.name + "Texture", derivedPath)
 
     return e
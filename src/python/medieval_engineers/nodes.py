@@ -1,18 +1,26 @@
 from itertools import chain
 import bpy
+import os
 import re
 import shutil
+import threading
+import time
 from os.path import join, dirname
 from os import makedirs
 from subprocess import CalledProcessError
-from string import Template
+from xml.etree import ElementTree
 from bpy.props import BoolProperty, EnumProperty, FloatProperty, StringProperty
 from bpy_extras.io_utils import path_reference_mode, orientation_helper, ImportHelper
 from .texture_files import TextureType
 from .types import sceneData, data, MEMaterialInfo
-from .utils import layer_bits, layer_bit, scene, first, PinnedScene, reportMessage, exportSettings
-from .export import ExportSettings, export_fbx, fbx_to_hkt, hkt_filter, write_pretty_xml, mwmbuilder, generateBlockDefXml
+from .utils import layer_bits, layer_bit, scene, first, PinnedScene, reportMessage, exportSettings, objectIndex, \
+    compiledTemplate
+from .export import ExportSettings, export_fbx, fbx_to_hkt, hkt_filter, write_pretty_xml, mwmbuilder, generateBlockDefXml, \
+    MwmBuilderJob, FbxWriteError
 from .mwmbuilder import material_xml, mwmbuilder_xml, lod_xml
+from .havok_options import HAVOK_OPTION_FILE_CONTENT
+from .tracing import traced
+from . import mesh_cache
 
 
 COLOR_OBJECTS_SKT  = (.50, .65, .80, 1)
@@ -30,7 +38,9 @@ OTHER = 'OTHER'
 OTHER_TYPES = {'OTHER'}
 MESH_LIKE_TYPES = {'CURVE', 'SURFACE', 'FONT', 'META'}
 
-ACCEPTABLE_OUTCOME = {'SUCCESS', 'PROBLEMS'}
+# 'SCHEDULED' files are produced later in the same export pass, e.g. by a MwmBuilderBatch
+# 'UNCHANGED' files were left as they are by an incremental export
+ACCEPTABLE_OUTCOME = {'SUCCESS', 'PROBLEMS', 'SCHEDULED', 'UNCHANGED'}
 
 class BlockExportTree(bpy.types.NodeTree):
     bl_idname = "MEBlockExportTree"
@@ -41,6 +51,11 @@ class BlockExportTree(bpy.types.NodeTree):
     def getAllMwmObjects(self):
         return chain.from_iterable((n.inputs['Objects'].getObjects() for n in self.nodes if isinstance(n, MwmFileNode)))
 
+    def update(self):
+        # links were added or removed
+        _plans.pop(self.name, None)
+        invalidateSocketStates()
+
 class ObjectSource:
     '''
         Enumerates scene-objects for a requesting socket
@@ -73,6 +88,10 @@ class Exporter:
     def export(self, exportContext):
         raise NotImplementedError("No export implemented")
 
+    def outputFiles(self, settings) -> list:
+        '''The files an export with the given settings produces, as far as they can be known up-front.'''
+        return []
+
 class ReadyState:
 
     def isReady(self):
@@ -117,22 +136,20 @@ class MESocket:
 
     def firstSource(self, named=None, type=None):
         '''Finds the first providing socket linked to this socket with the give name and type.'''
-        if self.is_linked:
-            for link in self.links:
-                if link.from_socket != self \
-                        and (named is None or link.from_socket.name == named) \
-                        and (type is None or isinstance(link.from_socket, type)):
-                    return link.from_socket
+        for fromSocket, toSocket in socketLinks(self):
+            if fromSocket != self \
+                    and (named is None or fromSocket.name == named) \
+                    and (type is None or isinstance(fromSocket, type)):
+                return fromSocket
         return None
 
     def firstSink(self, named=None, type=None):
         '''Finds the first receiving socket linked to this socket with the give name and type.'''
-        if self.is_linked:
-            for link in self.links:
-                if link.to_socket != self \
-                        and (named is None or link.from_socket.name == named) \
-                        and (type is None or isinstance(link.from_socket, type)):
-                    return link.to_socket
+        for fromSocket, toSocket in socketLinks(self):
+            if toSocket != self \
+                    and (named is None or fromSocket.name == named) \
+                    and (type is None or isinstance(fromSocket, type)):
+                return toSocket
         return None
 
 class TextSocket(MESocket, TextSource):
@@ -155,30 +172,46 @@ class TextSocket(MESocket, TextSource):
         2. another input-socket of the node if configured,
         3. a property of the node if configured
         4. from the sockets 'text'-property
+
+        During an export the text is expanded once per set of parameters until the export settings change,
+        later calls get the same text.
         '''
         if not self.enabled:
             return ""
 
+        mapping = args[0] if args else None
+        settings = exportSettings()
+        if settings is None or len(args) > 1 or not (mapping is None or mapping is settings):
+            return self.expandText(*args, **kwargs)
+
+        texts = settings.params.texts
+        key = (self.as_pointer(), not mapping is None) + tuple(sorted(kwargs.items()))
+        text = texts.get(key, None)
+        if text is None:
+            text = texts[key] = self.expandText(*((settings.params,) if args else ()), **kwargs)
+        return text
+
+    def expandText(self, *args, **kwargs) -> str:
         template = None
 
         source = self.firstSource(type=TextSource)
         if not source is None:
-            template = Template(source.getText(**kwargs))
+            template = source.getText(**kwargs)
 
         if template is None and self.node_input:
             inputSocket = self.node.inputs[self.node_input]
             if isinstance(inputSocket, TextSource):
-                template = Template(inputSocket.getText(**kwargs))
+                template = inputSocket.getText(**kwargs)
 
         if template is None and self.node_property:
-            template = Template(getattr(self.node, self.node_property))
+            template = getattr(self.node, self.node_property)
 
         if template is None:
-            template = Template(self.text)
+            template = self.text
 
         params = self.getParams()
         params.update(kwargs)
-        return template.safe_substitute(*args, **params)
+        return compiledTemplate(template).expand(params, *args)
 
     def getParams(self):
         params = {}
@@ -215,13 +248,41 @@ class ExportSocket(MESocket, Exporter):
         if source is None:
             raise ValueError("%s is not linked to an exporting source" % self.path_from_id())
 
-        return source.export(settings)
+        # the time goes to the exporting node, not to the node that depends on it
+        nested = settings.nestedDurations
+        nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            return source.export(settings)
+        finally:
+            duration = time.perf_counter() - start
+            own = duration - nested.pop()
+            if nested:
+                nested[-1] += duration
+            name = source.node.name
+            settings.dependencyDurations[name] = settings.dependencyDurations.get(name, 0.0) + own
 
 class ObjectsSocket(MESocket, ObjectSource, ParamSource, ReadyState):
     n: bpy.props.IntProperty(default=-1)
     layer: bpy.props.IntProperty()
 
     def getObjects(self, socket: bpy.types.NodeSocket=None):
+        '''
+        During an export the objects are collected once per socket, cube size and scene
+        and kept in the export pass' cache, later calls get the same tuple.
+        '''
+        settings = exportSettings()
+        if settings is None:
+            return self.collectObjects(socket)
+
+        key = ('ObjectsSocket.getObjects', self.id_data.name, self.node.name, self.is_output, self.identifier,
+               settings.CubeSize, scene().name)
+        objects = settings.cache.get(key, None)
+        if objects is None:
+            objects = settings.cache[key] = tuple(self.collectObjects(socket))
+        return objects
+
+    def collectObjects(self, socket: bpy.types.NodeSocket=None):
         if not self.enabled:
             return []
 
@@ -258,7 +319,7 @@ class ObjectsSocket(MESocket, ObjectSource, ParamSource, ReadyState):
 
     def drawColorChecked(self, context, node, source):
         color = super().drawColorChecked(context, node, source)
-        if self.is_linked and self.isEmpty():
+        if self.is_linked and socketState(self)[1]:
             color = (0.35, 0.35, 0.35, 1)
         return color
 
@@ -279,7 +340,7 @@ class FileSocket(TextSocket, ReadyState):
 
     def drawColorChecked(self, context, node, source):
         color = super().drawColorChecked(context, node, source)
-        if self.is_linked and not self.isReady():
+        if self.is_linked and not socketState(self)[0]:
             color = (0.35, 0.35, 0.35, 1)
             # r, g, b, a = color
             # color = (r, g, b, a * 0.2)
@@ -363,8 +424,8 @@ class RigidBodyObjectsSocket(bpy.types.NodeSocket, ObjectsSocket):
     bl_color = COLOR_OBJECTS_SKT
     type = 'CUSTOM'
 
-    def getObjects(self, socket: bpy.types.NodeSocket=None):
-        return (o for o in super().getObjects(socket) if o.type == 'MESH' and not o.rigid_body is None)
+    def collectObjects(self, socket: bpy.types.NodeSocket=None):
+        return (o for o in super().collectObjects(socket) if o.type == 'MESH' and not o.rigid_body is None)
 
 class ExportableObjectsSocket(bpy.types.NodeSocket, ObjectsSocket):
     '''selects only objects that are of an exportable type'''
@@ -373,12 +434,12 @@ class ExportableObjectsSocket(bpy.types.NodeSocket, ObjectsSocket):
     bl_color = COLOR_OBJECTS_SKT
     type = 'CUSTOM'
 
-    def getObjects(self, socket: bpy.types.NodeSocket=None):
+    def collectObjects(self, socket: bpy.types.NodeSocket=None):
         object_types = getattr(self.node, 'object_types', DEFAULT_OBJECT_TYPES)
         if OTHER in object_types:
             object_types = (object_types - OTHER_TYPES) | MESH_LIKE_TYPES
 
-        return (o for o in super().getObjects(socket) if o.type in object_types)
+        return (o for o in super().collectObjects(socket) if o.type in object_types)
 
 
 
@@ -425,6 +486,11 @@ class HavokFileNode(bpy.types.Node, MENode, Exporter, ReadyState):
 
         return hasObjects and hasName
 
+    def outputFiles(self, settings: ExportSettings) -> list:
+        name = self.inputs['Name'].getText(settings)
+        return [join(settings.outputDir, name + ".hkt")] if name else []
+
+    @traced('HavokFileNode.export', isNodeMethod=True)
     def export(self, settings: ExportSettings):
         name = self.inputs['Name'].getText(settings)
         if not name:
@@ -442,16 +508,50 @@ class HavokFileNode(bpy.types.Node, MENode, Exporter, ReadyState):
             settings.text("layers had no collision-objects for export", file=hktfile, node=self)
             return settings.cacheValue(hktfile, 'SKIPPED')
 
-        export_fbx(settings, fbxfile, objectsSource.getObjects())
+        if not settings.manifest is None:
+            from .manifest import Fingerprint
+            fingerprint = Fingerprint().value((hktfile, settings.scaleDown)).objects(objectsSource.getObjects())
+            if settings.isUnchanged(hktfile, fingerprint):
+                settings.text("unchanged since the last export", file=hktfile, node=self)
+                return settings.cacheValue(hktfile, 'UNCHANGED')
+
+        fbxfile = export_fbx(settings, fbxfile, objectsSource.getObjects())
+
+        if not settings.scheduler is None:
+            _ = settings.fbximporter, settings.havokfilter # resolve the tool paths on the main thread
+            settings.scheduler.submit(self, hktfile, lambda job: self.convert(job, settings, fbxfile, hktfile))
+            return settings.cacheValue(hktfile, 'SCHEDULED')
+
+        return settings.cacheValue(hktfile, self.convert(settings, settings, fbxfile, hktfile))
+
+    def convert(self, report, settings: ExportSettings, fbxfile: str, hktfile: str):
+        '''Runs the Havok tools. Might run outside of Blender's main thread, so messages go to report.'''
+        try:
+            settings.awaitFile(fbxfile)
+        except FbxWriteError as e:
+            report.error(str(e), file=hktfile, node=self)
+            return 'FAILED'
+
+        cache = settings.artifactCache
+        if not cache is None:
+            key = cache.key(files=(fbxfile,), tools=(settings.fbximporter, settings.havokfilter),
+                            extra=(HAVOK_OPTION_FILE_CONTENT,))
+            if cache.fetch(key, hktfile):
+                report.info("export successful, restored from the artifact cache", file=hktfile, node=self)
+                return 'SUCCESS'
+
         try:
             fbx_to_hkt(settings, fbxfile, hktfile)
             hkt_filter(settings, hktfile, hktfile)
         except CalledProcessError as e:
-            settings.error(str(e), file=hktfile, node=self)
-            return settings.cacheValue(hktfile, 'FAILED')
+            report.error(str(e), file=hktfile, node=self)
+            return 'FAILED'
+
+        if not cache is None:
+            cache.store(key, hktfile)
 
-        settings.info("export successful", file=hktfile, node=self)
-        return settings.cacheValue(hktfile, 'SUCCESS')
+        report.info("export successful", file=hktfile, node=self)
+        return 'SUCCESS'
 
 
 
@@ -700,6 +800,22 @@ class FbxExportProperties (bpy.types.PropertyGroup, ImportHelper):
         default=True,
         options={'HIDDEN'},
     )
+    # ME
+    array_compression: EnumProperty(
+        name="Array Compression",
+        items=(('FAST', "Fast", "Compress large arrays at zlib's fastest level, like Blender's FBX exporter"),
+               ('NONE', "None", "Write arrays uncompressed, the file is larger but written faster"),
+               ),
+        description="How the mesh data in the .fbx file is compressed. The file is only read by MwmBuilder",
+        default='FAST',
+    )
+    # ME
+    use_instancing: BoolProperty(
+        name="Share Linked Meshes",
+        description="Objects that share their mesh, materials and modifiers also share their geometry in the .fbx file. "
+                    "Only used if MwmBuilder builds the same model from such a file, which is checked once per session",
+        default=True,
+    )
 
 class MwmExportProperties(bpy.types.PropertyGroup):
     rescale_factor: bpy.props.FloatProperty(name="Rescale Factor", min=0.001, max=1000, soft_min=0.01, soft_max=10, default=0.01,
@@ -790,6 +906,8 @@ class MwmFileNode(bpy.types.Node, MENode, Exporter, ReadyState, Upgradable):
             sub = layout.row()
             #~ sub.enabled = f.mesh_smooth_type in {'OFF'}
             sub.prop(f, "use_tspace")
+            layout.prop(f, "array_compression")
+            layout.prop(f, "use_instancing")
         elif f.ui_tab == 'ARMATURE':
             layout.prop(f, "use_armature_deform_only")
             layout.prop(f, "add_leaf_bones")
@@ -807,6 +925,11 @@ class MwmFileNode(bpy.types.Node, MENode, Exporter, ReadyState, Upgradable):
             col.prop(f, "bake_anim_step")
             col.prop(f, "bake_anim_simplify_factor")
 
+    def outputFiles(self, settings: ExportSettings) -> list:
+        name = self.inputs['Name'].getText(settings)
+        return [join(settings.outputDir, name + ".mwm")] if name else []
+
+    @traced('MwmFileNode.export', isNodeMethod=True)
     def export(self, settings: ExportSettings):
         _ = settings.hadErrors # reset error tracking
 
@@ -824,8 +947,9 @@ class MwmFileNode(bpy.types.Node, MENode, Exporter, ReadyState, Upgradable):
             settings.text("layers had no objects for export", file=mwmfile, node=self)
             return settings.cacheValue(mwmfile, 'SKIPPED')
 
-        sockets = [s for s in self.inputs if s.name.startswith("LOD") and s.enabled and s.is_linked]
+        sockets = linkedInputs(self, "LOD")
         lods_xml = []
+        lodfiles = []
         msgs = []
         for i, socket in enumerate(sockets):
             lodName = socket.getText(settings)
@@ -833,6 +957,7 @@ class MwmFileNode(bpy.types.Node, MENode, Exporter, ReadyState, Upgradable):
                 lodDistance = socket.distance
                 renderQualities = socket.qualities if socket.use_qualities else None
                 lods_xml.append(lod_xml(settings, lodName, lodDistance, renderQualities))
+                lodfiles.append(join(settings.outputDir, lodName + ".mwm"))
             else:
                 # report skips grouped after the export of dependencies
                 msgs.append("socket '%s' not ready, skipped" % (socket.name))
@@ -857,24 +982,67 @@ class MwmFileNode(bpy.types.Node, MENode, Exporter, ReadyState, Upgradable):
         materials_xml = [material_xml(settings, m, mwmfile, self) for m in materials.values()]
 
         paramsfile = join(settings.outputDir, name + ".xml")
-        paramsxml = mwmbuilder_xml(settings, materials_xml, lods_xml, self.mwm_settings.rescale_factor, self.mwm_settings.rotation_y)
+        mwmSettings = nodeSettings(self, 'mwm_settings')
+        paramsxml = mwmbuilder_xml(settings, materials_xml, lods_xml, mwmSettings['rescale_factor'], mwmSettings['rotation_y'])
+
+        if not settings.manifest is None:
+            from .manifest import Fingerprint
+            fingerprint = Fingerprint() \
+                .value((mwmfile, settings.scaleDown, settings.isRunMwmbuilder, settings.isUseTangentSpace)) \
+                .bytes(ElementTree.tostring(paramsxml)) \
+                .rna(self.fbx_settings).rna(self.mwm_settings) \
+                .value(settings.fingerprints.get(havokfile, None)) \
+                .objects(objectsSource.getObjects())
+            if settings.isUnchanged(mwmfile, fingerprint):
+                settings.text("unchanged since the last export", file=mwmfile, node=self)
+                return settings.cacheValue(mwmfile, 'UNCHANGED')
+
         write_pretty_xml(paramsxml, paramsfile)
 
         fbxfile = join(settings.outputDir, name + ".fbx")
-        export_fbx(settings, fbxfile, objectsSource.getObjects(), self.fbx_settings)
+        fbxfile = export_fbx(settings, fbxfile, objectsSource.getObjects(), nodeSettings(self, 'fbx_settings'))
+
+        if not settings.mwmBatch is None and settings.isRunMwmbuilder:
+            settings.mwmBatch.add(MwmBuilderJob(self, fbxfile, havokfile, paramsfile, mwmfile, settings.hadErrors))
+            return settings.cacheValue(mwmfile, 'SCHEDULED')
+
+        if not settings.scheduler is None and settings.isRunMwmbuilder:
+            _ = settings.mwmbuilder # resolve the tool path on the main thread
+            hadErrors = settings.hadErrors
+            scheduler = settings.scheduler
+            havokJob = scheduler.job(havokfile) if havokfile else None
+            lodJobs = [j for j in (scheduler.job(f) for f in lodfiles) if not j is None]
+            scheduler.submit(self, mwmfile,
+                lambda job: self.build(job, settings, fbxfile, havokfile, paramsfile, mwmfile, hadErrors, havokJob, lodJobs),
+                lodJobs + [havokJob])
+            return settings.cacheValue(mwmfile, 'SCHEDULED')
+
+        return settings.cacheValue(mwmfile, self.build(settings, settings, fbxfile, havokfile, paramsfile, mwmfile, settings.hadErrors))
+
+    def build(self, report, settings: ExportSettings, fbxfile: str, havokfile: str, paramsfile: str, mwmfile: str,
+              hadErrors: bool, havokJob=None, lodJobs=[]):
+        '''Runs MwmBuilder. Might run outside of Blender's main thread, so messages go to report.'''
+        if not havokJob is None and not havokJob.outcome in ACCEPTABLE_OUTCOME:
+            report.info("no collision data included", file=mwmfile, node=self)
+            havokfile = None
+
+        for lodJob in lodJobs:
+            if not lodJob.outcome in ACCEPTABLE_OUTCOME:
+                report.error("level-of-detail %s failed" % (os.path.basename(lodJob.file)), file=mwmfile, node=self)
+                hadErrors = True
 
         try:
             mwmbuilder(settings, fbxfile, havokfile, paramsfile, mwmfile)
-        except CalledProcessError as e:
-            settings.error(str(e), file=mwmfile, node=self)
-            return settings.cacheValue(mwmfile, 'FAILED')
+        except (CalledProcessError, FbxWriteError) as e:
+            report.error(str(e), file=mwmfile, node=self)
+            return 'FAILED'
 
-        if not settings.hadErrors:
-            settings.info("export successful", file=mwmfile, node=self)
-            return settings.cacheValue(mwmfile, 'SUCCESS')
+        if not hadErrors:
+            report.info("export successful", file=mwmfile, node=self)
+            return 'SUCCESS'
         else:
-            settings.warn("export completed with problems", file=mwmfile, node=self)
-            return settings.cacheValue(mwmfile, 'PROBLEMS')
+            report.warn("export completed with problems", file=mwmfile, node=self)
+            return 'PROBLEMS'
 
 PATTERN_NAME = re.compile(r"^(.*?)(\.\d+)?$")
 
@@ -988,12 +1156,13 @@ class GroupFilterObjectsNode(bpy.types.Node, MENode, TextFilterNode, ObjectSourc
         self.color = COLOR_OBJECTS_WND
 
     def getObjects(self, socket: ObjectListSocket = None):
+        index = objectIndex()
         inSocket = self.inputs['Objects']
-        objects = inSocket.getObjects() if inSocket.is_linked else scene().objects
+        objects = inSocket.getObjects() if inSocket.is_linked else index.objects
         matcher = self.newMatcher()
-        return (obj for obj in objects
-            if any(g for g in obj.users_group if matcher(g.name))
-                or (self.use_inverted_match and len(obj.users_group) == 0))
+        return (obj for obj, groups in ((obj, index.groups(obj)) for obj in objects)
+            if any(g for g in groups if matcher(g))
+                or (self.use_inverted_match and len(groups) == 0))
 
     def getSearchSource(self):
         return (bpy.data, "groups")
@@ -1014,7 +1183,7 @@ class NameFilterObjectsNode(bpy.types.Node, MENode, TextFilterNode, ObjectSource
 
     def getObjects(self, socket: ObjectListSocket = None):
         inSocket = self.inputs['Objects']
-        objects = inSocket.getObjects() if inSocket.is_linked else scene().objects
+        objects = inSocket.getObjects() if inSocket.is_linked else objectIndex().objects
         matcher = self.newMatcher()
         return (obj for obj in objects if matcher(obj.name))
 
@@ -1041,7 +1210,7 @@ class BlockSizeFilterObjectsNode(bpy.types.Node, MENode, ObjectSource):
         settings = exportSettings()
         isSmall = (settings.CubeSize == 'Small') if settings else (data(scene()).block_size == 'SMALL')
         inSocket = self.inputs["Small Block Objects"] if isSmall else self.inputs["Large Block Objects"]
-        return inSocket.getObjects() if inSocket.is_linked else scene().objects
+        return inSocket.getObjects() if inSocket.is_linked else objectIndex().objects
 
 class LayerObjectsNode(bpy.types.Node, MENode, ObjectSource, Upgradable):
     bl_idname = "MELayerObjectsNode"
@@ -1072,8 +1241,7 @@ class LayerObjectsNode(bpy.types.Node, MENode, ObjectSource, Upgradable):
     def getObjects(self, socket: ObjectListSocket):
         mask = layer_bits(self.layer_mask)
         inputSocket = self.inputs["Objects"]
-        objects = inputSocket.getObjects() if inputSocket.is_linked else scene().objects
-        return (obj for obj in objects if (layer_bits(obj.layers) & mask) != 0)
+        return objectIndex().inLayers(inputSocket.getObjects() if inputSocket.is_linked else None, mask)
 
 class SeparateLayerObjectsNode(bpy.types.Node, MENode, ObjectSource, Upgradable):
     bl_idname = "MESeparateLayerObjectsNode"
@@ -1116,10 +1284,11 @@ class SeparateLayerObjectsNode(bpy.types.Node, MENode, ObjectSource, Upgradable)
         layout.prop(self, 'layer_mask')
 
     def getObjects(self, socket: ObjectListSocket):
-        mask = layer_bit(socket.layer)
+        index = objectIndex()
         inputSocket = self.inputs["Objects"]
-        objects = inputSocket.getObjects() if inputSocket.is_linked else scene().objects
-        return (obj for obj in objects if (layer_bits(obj.layers) & mask) != 0)
+        if not inputSocket.is_linked:
+            return index.byLayer[socket.layer]
+        return index.inLayers(inputSocket.getObjects(), layer_bit(socket.layer))
 
 class BlockDefinitionNode(bpy.types.Node, MENode, Exporter, ReadyState, Upgradable):
     bl_idname = "MEBlockDefNode"
@@ -1159,6 +1328,12 @@ class BlockDefinitionNode(bpy.types.Node, MENode, Exporter, ReadyState, Upgradab
         name = self.inputs['Main Model'].getText()
         return True and name # force bool result
 
+    def outputFiles(self, settings: ExportSettings) -> list:
+        mainModel = self.inputs['Main Model']
+        name = mainModel.getText(settings) if mainModel.is_linked else None
+        return [join(settings.outputDir, name + ".blockdef.xml")] if name else []
+
+    @traced('BlockDefinitionNode.export', isNodeMethod=True)
     def export(self, settings: ExportSettings):
         mainModel = self.inputs['Main Model']
         if not mainModel.is_linked:
@@ -1198,13 +1373,12 @@ class BlockDefinitionNode(bpy.types.Node, MENode, Exporter, ReadyState, Upgradab
         iconFile = iconPath if iconPath else None
 
         constrModelFiles = [] # maybe stays empty
-        for i, socket in enumerate(s for s in self.inputs if s.name.startswith('Constr')):
-            if socket.enabled and socket.is_linked:
-                constrName = socket.getText(settings)
-                if socket.isReady():
-                    constrModelFiles.append(constrName + ".mwm")
-                else:
-                    settings.text("socket '%s' not ready, skipped" % (socket.name), file=blockdeffile, node=self)
+        for socket in linkedInputs(self, 'Constr'):
+            constrName = socket.getText(settings)
+            if socket.isReady():
+                constrModelFiles.append(constrName + ".mwm")
+            else:
+                settings.text("socket '%s' not ready, skipped" % (socket.name), file=blockdeffile, node=self)
 
         xml = generateBlockDefXml(
             settings,
@@ -1313,6 +1487,142 @@ registered = [
 
 # -------------------------------------------------------------------------------------------------------------------- #
 
+# Every export asks the sockets of a tree for their links many times per pass, and each of these questions goes through
+# the RNA of Blender. An ExportPlan reads the links, exporters and node settings of a tree once and answers them
+# from plain Python while it is pinned. The node editor keeps plans until the tree or the scene changes, exports
+# compile their own so that they see the settings as they are when the export starts.
+
+def _snapshot(group: bpy.types.PropertyGroup) -> dict:
+    return {p : getattr(group, p) for p in group.rna_type.properties.keys()}
+
+class ExportPlan:
+    '''The links, exporter nodes and node settings of a BlockExportTree, read once and not changed afterwards.'''
+    __slots__ = ('tree', 'revision', 'links', 'inputs', 'settings', 'exporters', 'blockDef')
+
+    def __init__(self, tree: BlockExportTree, revision=None):
+        self.tree = tree.name
+        self.revision = revision
+        self.links = {} # socket.as_pointer() -> ((from_socket, to_socket), ...) in the order of socket.links
+        self.inputs = {} # node.as_pointer() -> enabled and linked input sockets
+        self.settings = {} # (node.as_pointer(), property-group) -> values of the group's properties
+
+        for node in tree.nodes:
+            for socket in chain(node.inputs, node.outputs):
+                self.links[socket.as_pointer()] = []
+            self.inputs[node.as_pointer()] = tuple(s for s in node.inputs if s.enabled and s.is_linked)
+            for group in ('fbx_settings', 'mwm_settings'):
+                if hasattr(node, group):
+                    self.settings[(node.as_pointer(), group)] = _snapshot(getattr(node, group))
+
+        for link in tree.links:
+            pair = (link.from_socket, link.to_socket)
+            self.links.setdefault(link.from_socket.as_pointer(), []).append(pair)
+            self.links.setdefault(link.to_socket.as_pointer(), []).append(pair)
+        self.links = {key : tuple(pairs) for key, pairs in self.links.items()}
+
+        self.exporters = tuple(n for n in tree.nodes if isinstance(n, Exporter))
+        self.blockDef = first(n for n in self.exporters if isinstance(n, BlockDefinitionNode))
+
+_plans = {} # tree name -> ExportPlan
+_planHolder = threading.local()
+
+def exportPlan(tree: BlockExportTree) -> ExportPlan:
+    '''The plan of the tree, compiled anew only if the tree or the scene changed since the last call.'''
+    plan = _plans.get(tree.name, None)
+    if plan is None or plan.revision != mesh_cache.revision():
+        plan = _plans[tree.name] = ExportPlan(tree, mesh_cache.revision())
+    return plan
+
+def currentPlan() -> ExportPlan:
+    return getattr(_planHolder, "plan", None)
+
+class PinnedPlan():
+    def __init__(self, plan: ExportPlan):
+        self.plan = plan
+        self.previousPlan = None
+
+    def __enter__(self):
+        self.previousPlan = getattr(_planHolder, "plan", None)
+        _planHolder.plan = self.plan
+        return self.plan
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _planHolder.plan = self.previousPlan
+
+def socketLinks(socket: bpy.types.NodeSocket) -> tuple:
+    '''The (from_socket, to_socket) pairs of the links of the socket, from the pinned plan if it knows the socket.'''
+    plan = currentPlan()
+    if not plan is None:
+        links = plan.links.get(socket.as_pointer(), None)
+        if not links is None:
+            return links
+    return tuple((l.from_socket, l.to_socket) for l in socket.links) if socket.is_linked else ()
+
+def linkedInputs(node: bpy.types.Node, prefix: str) -> tuple:
+    '''The enabled and linked input sockets of the node whose names start with prefix.'''
+    plan = currentPlan()
+    inputs = None if plan is None else plan.inputs.get(node.as_pointer(), None)
+    if inputs is None:
+        inputs = (s for s in node.inputs if s.enabled and s.is_linked)
+    return tuple(s for s in inputs if s.name.startswith(prefix))
+
+def nodeSettings(node: bpy.types.Node, group: str) -> dict:
+    '''The values of a property-group of the node as of the pinned plan.'''
+    plan = currentPlan()
+    values = None if plan is None else plan.settings.get((node.as_pointer(), group), None)
+    return values if not values is None else _snapshot(getattr(node, group))
+
+# -------------------------------------------------------------------------------------------------------------------- #
+
+# Evaluating if a socket is ready or empty walks its filter-chain and the objects of the scene, which is too slow
+# for every redraw of the node editor. A timer evaluates all linked sockets after the scene or a tree changed,
+# the draw callbacks only read the result.
+
+REFRESH_DELAY = 0.2 # seconds, changes in quick succession are evaluated together
+
+_socketStates = {} # (tree, node, is_output, identifier) -> (isReady, isEmpty)
+_statesRevision = None # mesh_cache.revision() and scene the states were evaluated for
+
+def _socketKey(socket) -> tuple:
+    return (socket.id_data.name, socket.node.name, socket.is_output, socket.identifier)
+
+def socketState(socket) -> tuple:
+    '''(isReady, isEmpty) of a linked socket as of the last refresh, a new socket counts as ready and not empty.'''
+    if _statesRevision != (mesh_cache.revision(), bpy.context.scene.name):
+        invalidateSocketStates()
+    return _socketStates.get(_socketKey(socket), (True, False))
+
+def invalidateSocketStates():
+    if not bpy.app.timers.is_registered(_refreshSocketStates):
+        bpy.app.timers.register(_refreshSocketStates, first_interval=REFRESH_DELAY)
+
+def _refreshSocketStates():
+    global _statesRevision
+    states = {}
+    scene = bpy.context.scene
+    # set first, so that a failing socket isn't evaluated over and over again
+    _statesRevision = (mesh_cache.revision(), scene.name)
+    with PinnedScene(scene):
+        for tree in bpy.data.node_groups:
+            if not isinstance(tree, BlockExportTree):
+                continue
+            with PinnedPlan(exportPlan(tree)):
+                for node in tree.nodes:
+                    for socket in chain(node.inputs, node.outputs):
+                        if not socketLinks(socket) or not isinstance(socket, (ObjectsSocket, FileSocket)):
+                            continue
+                        isReady = socket.isReady() if isinstance(socket, FileSocket) else True
+                        isEmpty = socket.isEmpty() if isinstance(socket, ObjectsSocket) else False
+                        states[_socketKey(socket)] = (isReady, isEmpty)
+
+    _socketStates.clear()
+    _socketStates.update(states)
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'NODE_EDITOR':
+                area.tag_redraw()
+    return None # just once
+
 @bpy.app.handlers.persistent
 def upgradeNodesAfterLoad(dummy):
     for nodeTree in bpy.data.node_groups:
@@ -1346,5 +1656,10 @@ def unregister():
     if upgradeNodesAfterLoad in bpy.app.handlers.load_post:
         bpy.app.handlers.load_post.remove(upgradeNodesAfterLoad)
 
+    if bpy.app.timers.is_registered(_refreshSocketStates):
+        bpy.app.timers.unregister(_refreshSocketStates)
+    _socketStates.clear()
+    _plans.clear()
+
     for c in reversed(registered):
         unregister_class(c)
@@ -1,18 +1,20 @@
 from collections import OrderedDict
 import os
-from subprocess import CalledProcessError
+from os.path import join
+import time
 from tempfile import TemporaryDirectory
 import bpy
 from bpy.utils import register_class, unregister_class
-from .export import ExportSettings, MissbehavingToolError
-from .merge_xml import CubeBlocksMerger, MergeResult
+from .export import ExportSettings, MwmBuilderBatch
 from .pbr_node_group import getDx11Shader, createDx11ShaderGroup
 from .types import upgradeToNodeMaterial
-from .types import getExportNodeTreeFromContext, getExportNodeTree, data, sceneData, MEMaterialInfo
-from .nodes import BlockDefinitionNode, Exporter, BlockExportTree, getBlockDef, LayerObjectsNode, SeparateLayerObjectsNode, \
-    getUsedMaterials
+from .types import getExportNodeTreeFromContext, data, sceneData, MEMaterialInfo
+from .nodes import BlockExportTree, getBlockDef, LayerObjectsNode, SeparateLayerObjectsNode, \
+    getUsedMaterials, ExportPlan, PinnedPlan
 from .utils import layers, layer_bits, layer_bit, PinnedScene, PinnedSettings
 from .default_nodes import createDefaultTree
+from .tracing import Tracer
+from . import tracing
 
 # mapping (scene.block_size) -> (block_size_name, apply_scale_down)
 SIZES = {
@@ -21,21 +23,31 @@ SIZES = {
     'SCALE_DOWN' : [('Large', False), ('Small', True)]
 }
 
+class ExportResult:
+    '''
+    The outcome of one export-node for one cube size.
+    The duration covers the node's own work in Blender and its external tools if they ran in a ToolScheduler.
+    '''
+    def __init__(self, exporter, cubeSize: str):
+        self.exporter = exporter
+        self.name = exporter.label if exporter.label else exporter.name
+        self.cubeSize = cubeSize
+        self.outcome = None
+        self.duration = 0.0
+        self.files = []
+
 class BlockExport:
     def __init__(self, settings: ExportSettings):
         self.settings = settings
+        self.results = OrderedDict() # (CubeSize, node name) -> ExportResult, filled by export()
 
-    def mergeBlockDefs(self, cubeBlocks: CubeBlocksMerger):
+    def mergeBlockDefs(self, cubeBlocks: 'CubeBlocksMerger'):
+        from .merge_xml import MergeResult
         settings = self.settings
 
         with PinnedScene(settings.scene):
-            with PinnedSettings(settings):
-                blockdefNode = None
-                for n in settings.exportNodes.nodes:
-                    if isinstance(n, BlockDefinitionNode):
-                        blockdefNode = n
-                        break
-
+            with PinnedSettings(settings), PinnedPlan(ExportPlan(settings.exportNodes)) as plan:
+                blockdefNode = plan.blockDef
                 if blockdefNode is None:
                     settings.error("No block-definition node in export node-tree '%s'" % (settings.exportNodes.name))
                     return False
@@ -66,27 +78,91 @@ class BlockExport:
         skips = OrderedDict()
         failures = OrderedDict()
         problems = OrderedDict()
+        unchanged = OrderedDict()
+
+        self.results.clear()
+
+        def record(exporter, result, duration=0.0):
+            key = (settings.CubeSize, exporter.name)
+            entry = self.results.get(key, None)
+            if entry is None:
+                entry = self.results[key] = ExportResult(exporter, settings.CubeSize)
+                entry.files = exporter.outputFiles(settings)
+            entry.outcome = result
+            entry.duration += duration + settings.dependencyDurations.pop(exporter.name, 0.0)
+
+            name = exporter.label if exporter.label else exporter.name
+            if 'SKIPPED' == result:
+                skips[name] = exporter
+            elif 'UNCHANGED' == result:
+                unchanged[name] = exporter
+            elif 'FAILED' == result:
+                failures[name] = exporter
+            elif 'PROBLEMS' == result:
+                problems[name] = exporter
+
+        settings.mwmBatch = MwmBuilderBatch() if settings.isBatchMwmbuilder else None
+        # only needed while exporting, so loaded on the first export
+        from .scheduler import ToolScheduler
+        from .manifest import ExportManifest
+        settings.scheduler = ToolScheduler(settings.maxToolJobs) if settings.maxToolJobs > 1 else None
+        settings.manifest = ExportManifest(settings.outputDir) if settings.isIncremental else None
+        tracer = Tracer(settings.scene.name) if settings.isTracing else None
+        if not tracer is None:
+            tracing.start(tracer)
 
-        with PinnedScene(settings.scene):
-            with PinnedSettings(settings):
-                for settings.CubeSize, settings.scaleDown in SIZES[settings.sceneData.block_size]:
-                    settings.cache.clear()
-
-                    self.ensureAtLeastOneTextureSlot(getUsedMaterials())
-
-                    for exporter in settings.exportNodes.nodes:
-                        if not isinstance(exporter, Exporter):
-                            continue
-
-                        name = exporter.label if exporter.label else exporter.name
-                        result = exporter.export(settings)
-                        if 'SKIPPED' == result:
-                            skips[name] = exporter
-                        elif 'FAILED' == result:
-                            failures[name] = exporter
-                        elif 'PROBLEMS' == result:
-                            problems[name] = exporter
-
+        try:
+            with PinnedScene(settings.scene):
+                with PinnedSettings(settings), PinnedPlan(ExportPlan(settings.exportNodes)) as plan:
+                    for settings.CubeSize, settings.scaleDown in SIZES[settings.sceneData.block_size]:
+                        settings.cache.clear()
+                        settings.dependencyDurations.clear()
+                        if not tracer is None:
+                            tracer.cubeSize = settings.CubeSize
+
+                        self.ensureAtLeastOneTextureSlot(getUsedMaterials())
+
+                        for exporter in plan.exporters:
+                            # only the node's own work, see ExportSocket.export() for its dependencies
+                            settings.nestedDurations[:] = [0.0]
+                            start = time.perf_counter()
+                            result = exporter.export(settings)
+                            record(exporter, result, time.perf_counter() - start - settings.nestedDurations[0])
+
+                        # 'SCHEDULED' nodes get their final outcome once their tools ran
+                        if not settings.scheduler is None:
+                            for job in settings.scheduler.wait(settings):
+                                record(job.node, job.outcome, job.duration)
+                        if not settings.mwmBatch is None:
+                            for job in settings.mwmBatch.run(settings):
+                                record(job.node, job.outcome)
+                        settings.awaitFiles()
+
+                        if not settings.manifest is None:
+                            settings.manifest.commit(settings.cache, settings.fingerprints)
+                            settings.fingerprints.clear()
+        finally:
+            if not settings.scheduler is None:
+                settings.scheduler.shutdown()
+                settings.scheduler = None
+            settings.awaitFiles(raiseErrors=False)
+            if not settings.artifactCache is None:
+                settings.artifactCache.report(settings)
+                settings.artifactCache.evict()
+            if not settings.manifest is None:
+                settings.manifest.save()
+            if not tracer is None:
+                tracing.stop()
+                tracefile = join(settings.outputDir, settings.BlockPairName + '.trace.json')
+                try:
+                    os.makedirs(settings.outputDir, exist_ok=True)
+                    tracer.write(tracefile)
+                    settings.info("time spent: %s" % (tracer.summary()), file=tracefile)
+                except OSError as e: # must not hide an error of the export itself
+                    settings.warn("could not write the trace: %s" % (e), file=tracefile)
+
+        if unchanged:
+            settings.info("Some export-nodes were unchanged since the last export: %s" % list(unchanged.keys()))
         if skips:
             settings.info("Some export-nodes were skipped: %s" % list(skips.keys()))
         if problems:
@@ -139,6 +215,16 @@ class ExportSceneAsBlock(bpy.types.Operator):
     skip_mwmbuilder: bpy.props.BoolProperty(
         name="Skip mwmbuilder",
         description="Export intermediary files but do not run them through mwmbuilder")
+    only_changed: bpy.props.BoolProperty(
+        name="Only Changed Models",
+        description="Skip models whose objects, materials and settings did not change since they were last exported")
+    batch_mwmbuilder: bpy.props.BoolProperty(
+        name="Batch mwmbuilder",
+        description="Run mwmbuilder only once per block size for all models of a block instead of once per model")
+    scene_workers: bpy.props.IntProperty(
+        name="Parallel Scenes", default=1, min=1, max=64,
+        description="When exporting all scenes: how many background Blender processes share the work. "
+                    "The .blend file must have been saved")
     use_tspace: bpy.props.BoolProperty(
         name="Tangent Space",
         description="Add binormal and tangent vectors, together with normal they form the tangent space "
@@ -180,7 +266,12 @@ class ExportSceneAsBlock(bpy.types.Operator):
 
         col = lay.column()
         col.prop(self, "all_scenes")
+        row = col.row()
+        row.enabled = self.all_scenes
+        row.prop(self, "scene_workers")
         col.prop(self, "skip_mwmbuilder")
+        col.prop(self, "batch_mwmbuilder")
+        col.prop(self, "only_changed")
         # col.prop(self, "use_tspace")
 
     def execute(self, context):
@@ -197,35 +288,29 @@ class ExportSceneAsBlock(bpy.types.Operator):
             else:
                 scenes = [context.scene]
 
-            with TemporaryDirectory() as tmpDir:
-                wm = context.window_manager
-                wm.progress_begin(0, len(scenes))
-                try:
-                    for i, scene in enumerate(scenes):
-                        # exporting via the export-menu explicitly asks for an export-directory
-                        outputDir = self.directory if context.space_data.type == 'INFO' else None
-                        # exporting all nodes will use their respective export-settings
-                        exportSettings = getExportNodeTree(self.settings_name) if not self.all_scenes else None
-                        settings = ExportSettings(scene, outputDir, exportSettings, tmpDir)
-
-                        settings.operator = self
-                        settings.isRunMwmbuilder = not self.skip_mwmbuilder
-                        settings.isUseTangentSpace = self.use_tspace
-
-                        BlockExport(settings).export()
-
-                        wm.progress_update(i)
-                finally:
-                    wm.progress_end()
-
-        except FileNotFoundError as e: # raised when the addon preferences are missing some tool paths
-            self.report({'ERROR'}, "Configuration error: %s" % e)
-
-        except CalledProcessError as e:
-            self.report({'ERROR'}, "An external tool failed, check generated logs: %s" % e)
-
-        except MissbehavingToolError as e:
-            self.report({'ERROR'}, str(e))
+            options = {
+                # exporting via the export-menu explicitly asks for an export-directory
+                'outputDir': self.directory if context.space_data.type == 'INFO' else None,
+                # exporting all nodes will use their respective export-settings
+                'settingsName': self.settings_name if not self.all_scenes else None,
+                'skipMwmbuilder': self.skip_mwmbuilder,
+                'batchMwmbuilder': self.batch_mwmbuilder,
+                'onlyChanged': self.only_changed,
+                'useTangentSpace': self.use_tspace,
+            }
+
+            from .parallel import export_scenes, export_scenes_parallel
+            wm = context.window_manager
+            wm.progress_begin(0, len(scenes))
+            try:
+                if self.all_scenes and self.scene_workers > 1 and len(scenes) > 1:
+                    export_scenes_parallel(self, scenes, options, self.scene_workers, progress=wm.progress_update)
+                else:
+                    with TemporaryDirectory() as tmpDir:
+                        for i, (scene, _) in enumerate(export_scenes(scenes, options, self, tmpDir)):
+                            wm.progress_update(i)
+            finally:
+                wm.progress_end()
 
         finally:
             if context.active_object and org_mode and bpy.ops.object.mode_set.poll():
@@ -286,6 +371,8 @@ class UpdateDefinitionsFromBlockScene(bpy.types.Operator):
         col.prop(self, "create_backup")
 
     def execute(self, context):
+        from .merge_xml import CubeBlocksMerger
+
         path = bpy.path.abspath(self.filepath)
         merger = CubeBlocksMerger(cubeBlocksPath=path, backup=self.create_backup)
 
@@ -0,0 +1,214 @@
+import json
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+import traceback
+from contextlib import contextmanager
+from subprocess import CalledProcessError
+from tempfile import TemporaryDirectory
+import bpy
+
+from .export import ExportSettings, MissbehavingToolError
+from .types import getExportNodeTree, prefs
+
+# marks the lines of a worker's output that carry a report, everything else is Blender's own output
+REPORT_PREFIX = 'MEEXPORT:'
+
+class JsonLineReporter:
+    '''Writes the reports of a worker as JSON lines to stdout so that the process that started it can pick them up.'''
+
+    def __init__(self, scene: str):
+        self.scene = scene
+
+    def report(self, type, message):
+        line = json.dumps({'scene': self.scene, 'type': sorted(type), 'message': message})
+        sys.stdout.write(REPORT_PREFIX + line + '\n')
+        sys.stdout.flush()
+
+def shard(items: list, count: int) -> list:
+    '''Distributes the items round-robin over at most count shards.'''
+    shards = [items[i::count] for i in range(count)]
+    return [s for s in shards if s]
+
+@contextmanager
+def snapshot(name: str):
+    '''
+    Saves a copy of the current .blend file for background Blender processes and removes it afterwards.
+    The copy is saved next to the .blend file, so that relative paths resolve just the same.
+    '''
+    head, tail = os.path.split(bpy.data.filepath)
+    path = os.path.join(head, '.%s.%s.blend' % (os.path.splitext(tail)[0], name))
+    bpy.ops.wm.save_as_mainfile(filepath=path, copy=True, check_existing=False)
+    try:
+        yield path
+    finally:
+        os.remove(path)
+
+def export_scenes(scenes: list, options: dict, operator, mwmDir: str):
+    '''
+    Exports the given scenes with the given options. Used by the export-operator and by worker processes alike.
+    operator only needs a report(type, message) method and may be a function of the scene.
+    Yields each scene together with its BlockExport once it's done, the BlockExport is None if the export failed early.
+    '''
+    # imported late because operators imports this module
+    from .operators import BlockExport
+
+    outputDir = options.get('outputDir', None)
+    exportNodes = getExportNodeTree(options['settingsName']) if options.get('settingsName', None) else None
+
+    for scene in scenes:
+        reporter = operator(scene) if callable(operator) else operator
+        export = None
+        try:
+            settings = ExportSettings(scene, outputDir, exportNodes, mwmDir)
+            settings.operator = reporter
+            settings.isRunMwmbuilder = not options.get('skipMwmbuilder', False)
+            settings.isBatchMwmbuilder = options.get('batchMwmbuilder', False)
+            settings.isIncremental = options.get('onlyChanged', False)
+            settings.isUseTangentSpace = options.get('useTangentSpace', False)
+            settings.maxToolJobs = options.get('maxToolJobs', settings.maxToolJobs)
+            settings.fbxWriterProcesses = options.get('fbxWriterProcesses', settings.fbxWriterProcesses)
+            settings.bakeProcesses = options.get('bakeProcesses', settings.bakeProcesses)
+
+            blockExport = BlockExport(settings)
+            blockExport.export()
+            export = blockExport
+
+        except FileNotFoundError as e: # raised when the addon preferences are missing some tool paths
+            reporter.report({'ERROR'}, "Configuration error: %s" % e)
+
+        except CalledProcessError as e:
+            reporter.report({'ERROR'}, "An external tool failed, check generated logs: %s" % e)
+
+        except MissbehavingToolError as e:
+            reporter.report({'ERROR'}, str(e))
+
+        except Exception as e: # the next scene might work
+            traceback.print_exc()
+            reporter.report({'ERROR'}, "Export failed: %s: %s" % (type(e).__name__, e))
+
+        yield scene, export
+
+def worker():
+    '''Entry point of a worker process, see export_scenes_parallel(). Arguments are passed as JSON after "--".'''
+    args = json.loads(sys.argv[sys.argv.index('--') + 1])
+    scenes = [bpy.data.scenes[name] for name in args['scenes']]
+
+    with TemporaryDirectory() as mwmDir:
+        for scene, _ in export_scenes(scenes, args['options'], lambda scene: JsonLineReporter(scene.name), mwmDir):
+            sys.stdout.write(REPORT_PREFIX + json.dumps({'scene': scene.name, 'done': True}) + '\n')
+            sys.stdout.flush()
+
+def export_scenes_parallel(operator, scenes: list, options: dict, workers: int, progress=None):
+    '''
+    Exports the scenes in several background Blender processes that work on a snapshot() of the current .blend file.
+    Reports of the workers are forwarded to the operator, scenes that a worker didn't finish are reported as errors.
+    '''
+    if not bpy.data.filepath:
+        operator.report({'ERROR'}, "Save the .blend file before exporting scenes in parallel")
+        return
+
+    messages = queue.Queue()
+
+    def pump(process):
+        for line in process.stdout:
+            line = line.decode('utf-8', errors='replace').rstrip()
+            if line.startswith(REPORT_PREFIX):
+                messages.put(json.loads(line[len(REPORT_PREFIX):]))
+        process.wait()
+        messages.put(process)
+
+    # the workers share the tool processes and FBX writers that the preferences allow
+    shards = shard([scene.name for scene in scenes], workers)
+    options = dict(options,
+        maxToolJobs=max(1, prefs().max_tool_jobs // max(1, len(shards))),
+        fbxWriterProcesses=prefs().fbx_writer_processes // max(1, len(shards)),
+        bakeProcesses=prefs().bake_processes // max(1, len(shards)))
+
+    bootstrap = "from %s import parallel; parallel.worker()" % (__package__)
+    processes = []
+    unfinished = {} # process -> names of its scenes that it didn't report as done yet
+    with snapshot('export-snapshot') as blendfile:
+        try:
+            for names in shards:
+                args = json.dumps({'scenes': names, 'options': options})
+                process = subprocess.Popen(
+                    [bpy.app.binary_path, '-b', blendfile, '--python-exit-code', '1',
+                        '--python-expr', bootstrap, '--', args],
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                processes.append(process)
+                unfinished[process] = set(names)
+                threading.Thread(target=pump, args=(process,), daemon=True).start()
+
+            running = len(processes)
+            done = 0
+            while running > 0:
+                msg = messages.get()
+                if isinstance(msg, subprocess.Popen):
+                    running -= 1
+                    if msg.returncode != 0:
+                        operator.report({'ERROR'}, "export worker failed with exit-code %d" % (msg.returncode))
+                    for name in sorted(unfinished[msg]):
+                        operator.report({'ERROR'}, "export worker ended before scene %s was exported" % (name))
+                elif msg.get('done', False):
+                    for names in unfinished.values():
+                        names.discard(msg['scene'])
+                    done += 1
+                    if not progress is None:
+                        progress(done)
+                else:
+                    operator.report(set(msg['type']), msg['message'])
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+
+def bake_worker():
+    '''Entry point of a bake worker, see bake_actions_parallel(). Arguments are passed as JSON after "--".'''
+    from . import fbx
+    from .export import STDOUT_OPERATOR
+    args = json.loads(sys.argv[sys.argv.index('--') + 1])
+    baked = fbx.bake(STDOUT_OPERATOR, args['request'], args['actions'], args['result'] + '.fbx')
+    with open(args['result'], 'wb') as f:
+        pickle.dump(baked, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def bake_actions_parallel(operator, request: dict, actions: list, processes: int) -> dict:
+    '''
+    Bakes the actions of an fbx.save_single() request in background Blender processes, see fbx.bake().
+    Returns what they baked by fbx._bake_key(). The actions of a process that failed are missing
+    and reported as a warning, the export bakes them itself then.
+    '''
+    if not bpy.data.filepath: # see snapshot()
+        return {}
+
+    baked = {}
+    bootstrap = "from %s import parallel; parallel.bake_worker()" % (__package__)
+    workers = []
+    # the export's own worker processes may bake at the same time, they all run from the same .blend file
+    with TemporaryDirectory() as tmpDir, snapshot('bake-snapshot-%d' % os.getpid()) as blendfile:
+        try:
+            for i, names in enumerate(shard(actions, processes)):
+                result = os.path.join(tmpDir, 'baked%d.pickle' % i)
+                args = json.dumps({'request': request, 'actions': names, 'result': result})
+                with open(result + '.log', 'wb') as log:
+                    workers.append((result, subprocess.Popen(
+                        [bpy.app.binary_path, '-b', blendfile, '--python-exit-code', '1',
+                            '--python-expr', bootstrap, '--', args],
+                        stdout=log, stderr=subprocess.STDOUT)))
+
+            for result, process in workers:
+                if process.wait() != 0:
+                    operator.report({'WARNING'}, "baking actions in a background process failed with exit-code %d"
+                        % (process.returncode))
+                    continue
+                with open(result, 'rb') as f:
+                    baked.update(pickle.load(f))
+        finally:
+            for _, process in workers:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+    return baked
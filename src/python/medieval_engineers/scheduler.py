@@ -0,0 +1,127 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+import time
+
+from . import tracing
+
+
+class ToolJob:
+    '''
+        An invocation of external tools that runs in a worker thread once all the jobs it depends on are done.
+        Messages are collected and reported from Blender's main thread by ToolScheduler.wait().
+        A job has the same reporting methods as ExportSettings so code can report to either one.
+    '''
+
+    def __init__(self, node, file: str, run, deps: list):
+        self.node = node
+        self.file = file
+        self.run = run
+        self.deps = deps
+        self.outcome = None
+        self.exception = None
+        self.done = False
+        self.duration = 0.0
+        self.messages = []
+
+    def msg(self, level, msg, file=None, node=None):
+        self.messages.append((level, msg, file, node))
+
+    def warn(self, msg, file=None, node=None):
+        self.msg('WARNING', msg, file, node)
+
+    def error(self, msg, file=None, node=None):
+        self.msg('ERROR', msg, file, node)
+
+    def info(self, msg, file=None, node=None):
+        self.msg('INFO', msg, file, node)
+
+    def text(self, msg, file=None, node=None):
+        self.msg('OPERATOR', msg, file, node)
+
+class ToolScheduler:
+    '''
+        Runs ToolJobs in a bounded pool of worker threads while respecting their dependencies.
+        Jobs must be submitted and waited for on Blender's main thread, only job.run() is executed by the workers.
+        job.run() receives the job and returns the outcome ('SUCCESS', 'FAILED', ...) for job.file.
+    '''
+
+    def __init__(self, maxWorkers: int):
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        self.lock = threading.Lock()
+        self.finished = queue.Queue()
+        self.jobs = {}
+        self.pending = 0 # only touched by the main thread
+        self.blocked = {}
+        self.dependents = defaultdict(list)
+
+    def job(self, file: str) -> ToolJob:
+        '''The job that produces the given file in the current pass, if any.'''
+        return self.jobs.get(file, None)
+
+    def submit(self, node, file: str, run, deps=()) -> ToolJob:
+        job = ToolJob(node, file, run, [d for d in deps if not d is None])
+        self.jobs[file] = job
+        self.pending += 1
+
+        with self.lock:
+            unfinished = [d for d in job.deps if not d.done]
+            if unfinished:
+                self.blocked[job] = len(unfinished)
+                for d in unfinished:
+                    self.dependents[d].append(job)
+                return job
+
+        self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: ToolJob):
+        start = time.perf_counter()
+        try:
+            with tracing.span('ToolJob', node=job.node, file=os.path.basename(job.file)):
+                job.outcome = job.run(job)
+        except Exception as e:
+            job.exception = e
+            job.outcome = 'FAILED'
+        job.duration = time.perf_counter() - start
+
+        ready = []
+        with self.lock:
+            job.done = True
+            for dependent in self.dependents.pop(job, []):
+                self.blocked[dependent] -= 1
+                if self.blocked[dependent] == 0:
+                    del self.blocked[dependent]
+                    ready.append(dependent)
+
+        for dependent in ready:
+            self.executor.submit(self._run, dependent)
+        self.finished.put(job)
+
+    def wait(self, settings) -> list:
+        '''
+        Waits for all submitted jobs and reports their messages and outcomes in the order they finished.
+        Re-raises the first unexpected exception of a job once all jobs are done, just like the sequential export would.
+        '''
+        jobs = []
+        while self.pending > 0:
+            job = self.finished.get()
+            self.pending -= 1
+            jobs.append(job)
+
+            for level, msg, file, node in job.messages:
+                settings.msg(level, msg, file, node)
+            settings.cacheValue(job.file, job.outcome)
+
+        self.jobs.clear()
+
+        for job in jobs:
+            if not job.exception is None:
+                raise job.exception
+
+        return jobs
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
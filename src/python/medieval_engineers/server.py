@@ -0,0 +1,267 @@
+'''
+Keeps a background Blender with the add-on loaded around so that many small exports don't pay Blender's startup each.
+
+Start the server:
+
+    blender -b --python-expr "from medieval_engineers import server; server.run()" -- --port 47400
+
+Submit jobs with plain Python, the client part of this module has no dependency on Blender:
+
+    python server.py --port 47400 export Blocks.blend --scene "Wall*"
+    python server.py --port 47400 merge Blocks.blend --cubeblocks Data/CubeBlocks.sbc
+    python server.py --port 47400 shutdown
+
+"export" takes the same arguments as the command-line export in cli.py.
+
+Clients must know the server's authkey. Unless one is passed with --authkey or the environment variable
+ME_EXPORT_SERVER_KEY the server generates a random key at startup and writes it to a file in ~/.medieval_engineers
+that only the user can read, where clients on the same machine find it. Requests and replies are JSON.
+Only top-level imports from the standard library are allowed in here, everything else is imported where it's used.
+'''
+import sys
+if __name__ == '__main__':
+    # run as a script, the add-on's types.py would shadow the standard library's types module
+    del sys.path[0]
+
+import argparse
+import json
+import os
+import secrets
+import traceback
+from multiprocessing.connection import Client, Listener
+
+DEFAULT_PORT = 47400
+AUTHKEY_VARIABLE = 'ME_EXPORT_SERVER_KEY'
+
+EXIT_OK = 0
+EXIT_USAGE = 2
+EXIT_ERROR = 4
+
+def keyfile(port: int) -> str:
+    return os.path.join(os.path.expanduser('~'), '.medieval_engineers', 'export-server-%d.key' % port)
+
+def _authkey(authkey: str=None, port: int=DEFAULT_PORT) -> bytes:
+    '''The authkey from the argument, the environment or the key file of a running server, None if there is none.'''
+    authkey = authkey or os.environ.get(AUTHKEY_VARIABLE, None)
+    if not authkey:
+        try:
+            with open(keyfile(port), 'r', encoding='utf-8') as f:
+                authkey = f.read().strip()
+        except OSError:
+            pass
+    return authkey.encode('utf-8') if authkey else None
+
+def _write_keyfile(port: int, authkey: bytes) -> str:
+    path = keyfile(port)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.chmod(path, 0o600) # the file might have existed with other permissions
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(authkey.decode('utf-8'))
+    return path
+
+def _send(conn, msg: dict):
+    conn.send_bytes(json.dumps(msg).encode('utf-8'))
+
+def _recv(conn) -> dict:
+    msg = json.loads(conn.recv_bytes().decode('utf-8'))
+    if not isinstance(msg, dict):
+        raise ValueError("malformed message")
+    return msg
+
+def _parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--host', default='127.0.0.1', help="the interface to listen on / connect to")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--authkey', help="shared secret, defaults to the environment variable " + AUTHKEY_VARIABLE +
+        " or the key file the server wrote")
+    return parser
+
+# ---------------------------------------------- server, runs in Blender ---------------------------------------------- #
+
+def handle_export(request: dict, send) -> int:
+    from . import cli
+
+    try:
+        args = cli.parse_args(request.get('argv', []))
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else EXIT_USAGE
+
+    def forward(scene, level, message):
+        send({'type': 'message', 'scene': scene, 'level': level, 'message': message})
+
+    exitCode, summary = cli.export(args, forward)
+    send({'type': 'summary', 'summary': summary})
+    return exitCode
+
+def handle_merge(request: dict, send) -> int:
+    from . import cli
+    from .export import ExportSettings
+    from .merge_xml import CubeBlocksMerger
+    from .operators import BlockExport
+
+    blendfile = os.path.abspath(request['blendfile'])
+    if not cli.open_blendfile(blendfile):
+        send({'type': 'message', 'scene': None, 'level': 'ERROR', 'message': "no such .blend file: " + blendfile})
+        return EXIT_ERROR
+
+    try:
+        merger = CubeBlocksMerger(
+            cubeBlocksPath=os.path.abspath(request['cubeblocks']),
+            backup=request.get('backup', True),
+            allowRenames=request.get('allowRenames', False))
+    except (OSError, ValueError) as e:
+        send({'type': 'message', 'scene': None, 'level': 'ERROR', 'message': str(e)})
+        return EXIT_ERROR
+
+    exitCode = EXIT_OK
+    patterns = request.get('scenes', None)
+    for scene in cli.select_scenes(patterns):
+        settings = ExportSettings(scene)
+        settings.operator = cli.CollectingReporter(scene.name,
+            lambda scene, level, message: send({'type': 'message', 'scene': scene, 'level': level, 'message': message}))
+        if not BlockExport(settings).mergeBlockDefs(merger):
+            exitCode = cli.EXIT_PROBLEMS
+
+    merger.write()
+    return exitCode
+
+HANDLERS = {
+    'export': handle_export,
+    'merge': handle_merge,
+}
+
+def serve(address: tuple, authkey: bytes):
+    '''Handles one job after the other until a client asks for a shutdown.'''
+    if not authkey:
+        raise ValueError("the export server needs an authkey")
+
+    with Listener(address, authkey=authkey) as listener:
+        print("Medieval Engineers export server listening on %s:%d" % listener.address, flush=True)
+        running = True
+        while running:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError) as e: # e.g. a client with the wrong authkey
+                print("rejected connection: %s" % e, file=sys.stderr, flush=True)
+                continue
+
+            with conn:
+                send = lambda msg: _send(conn, msg)
+                try:
+                    try:
+                        request = _recv(conn)
+                    except ValueError as e:
+                        send({'type': 'message', 'scene': None, 'level': 'ERROR', 'message': "bad request: %s" % e})
+                        send({'type': 'done', 'exitCode': EXIT_USAGE})
+                        continue
+
+                    command = request.get('command', None)
+                    if command == 'shutdown':
+                        running = False
+                        send({'type': 'done', 'exitCode': EXIT_OK})
+                        continue
+
+                    handler = HANDLERS.get(command, None)
+                    if handler is None:
+                        send({'type': 'message', 'scene': None, 'level': 'ERROR',
+                              'message': "unknown command %r" % (command)})
+                        send({'type': 'done', 'exitCode': EXIT_USAGE})
+                        continue
+
+                    cwd = os.getcwd()
+                    os.chdir(request.get('cwd', cwd)) # relative paths are meant relative to the client
+                    try:
+                        exitCode = handler(request, send)
+                    except Exception as e: # keep serving, the next job might work
+                        traceback.print_exc()
+                        send({'type': 'message', 'scene': None, 'level': 'ERROR',
+                              'message': "%s: %s" % (type(e).__name__, e)})
+                        exitCode = EXIT_ERROR
+                    finally:
+                        os.chdir(cwd)
+                    send({'type': 'done', 'exitCode': exitCode})
+
+                except (OSError, EOFError) as e: # the client went away
+                    print("lost connection: %s" % e, file=sys.stderr, flush=True)
+
+def run():
+    '''Entry point inside Blender, arguments are passed after "--".'''
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    args = _parser("Runs the Medieval Engineers export server.").parse_args(argv)
+    authkey = args.authkey or os.environ.get(AUTHKEY_VARIABLE, None)
+    authkey = authkey.encode('utf-8') if authkey else secrets.token_hex(32).encode('utf-8')
+    path = _write_keyfile(args.port, authkey)
+    print("authkey written to %s" % (path), flush=True)
+    serve((args.host, args.port), authkey)
+
+# ------------------------------------------- client, runs in plain Python -------------------------------------------- #
+
+def submit(address: tuple, request: dict, authkey: bytes, onMessage=None) -> tuple:
+    '''
+    Sends a job to a running server and waits until it is done.
+    onMessage(msg) receives the reports of the export while it runs.
+    Returns the exit-code of the job and its summary, if there is one.
+    '''
+    request.setdefault('cwd', os.getcwd())
+    summary = None
+    if not authkey:
+        raise ValueError("no authkey for the export server")
+
+    with Client(address, authkey=authkey) as conn:
+        _send(conn, request)
+        while True:
+            msg = _recv(conn)
+            if msg['type'] == 'done':
+                return msg['exitCode'], summary
+            elif msg['type'] == 'summary':
+                summary = msg['summary']
+            elif not onMessage is None:
+                onMessage(msg)
+
+def client_main(argv: list=None) -> int:
+    parser = _parser("Submits jobs to a Medieval Engineers export server.")
+    parser.add_argument('command', choices=['export', 'merge', 'shutdown'])
+    parser.add_argument('--json', metavar='FILE', help="write the summary of an export to this file")
+    args, rest = parser.parse_known_args(argv)
+
+    if args.command == 'export':
+        request = {'command': 'export', 'argv': rest} # parsed by the server, see cli.parse_args()
+    elif args.command == 'merge':
+        merge = argparse.ArgumentParser(prog=parser.prog + ' merge')
+        merge.add_argument('blendfile', metavar='BLEND')
+        merge.add_argument('--cubeblocks', metavar='FILE', required=True, help="the CubeBlocks.sbc to update")
+        merge.add_argument('--scene', action='append', dest='scenes', metavar='PATTERN',
+            help="only merge block-scenes whose name matches this wildcard pattern, can be repeated")
+        merge.add_argument('--no-backup', action='store_true', help="don't backup the CubeBlocks.sbc")
+        merge.add_argument('--allow-renames', action='store_true', help="update SubtypeIds")
+        margs = merge.parse_args(rest)
+        request = {'command': 'merge', 'blendfile': margs.blendfile, 'cubeblocks': margs.cubeblocks,
+                   'scenes': margs.scenes, 'backup': not margs.no_backup, 'allowRenames': margs.allow_renames}
+    else:
+        request = {'command': 'shutdown'}
+
+    def onMessage(msg):
+        prefix = "[%s] " % msg['scene'] if msg.get('scene', None) else ""
+        print("%s%s: %s" % (prefix, msg['level'], msg['message']), file=sys.stderr, flush=True)
+
+    authkey = _authkey(args.authkey, args.port)
+    if authkey is None:
+        print("no authkey: pass --authkey, set %s or start the server on this machine" % (AUTHKEY_VARIABLE),
+              file=sys.stderr)
+        return EXIT_USAGE
+
+    exitCode, summary = submit((args.host, args.port), request, authkey, onMessage)
+
+    if not summary is None:
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+        else:
+            json.dump(summary, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+
+    return exitCode
+
+if __name__ == '__main__':
+    sys.exit(client_main())
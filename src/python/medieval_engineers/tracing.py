@@ -0,0 +1,135 @@
+from collections import OrderedDict, defaultdict
+from functools import wraps
+import json
+import os
+import threading
+import time
+
+# the Tracer of the running export, None if tracing is off
+_tracer = None
+
+class Span:
+    __slots__ = ('name', 'args', 'start', 'children')
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+        self.start = 0.0
+        self.children = 0.0 # time spent in nested spans
+
+class Tracer:
+    '''
+    Records nested spans of an export and writes them in Chrome's trace-event format,
+    which can be opened in chrome://tracing or https://ui.perfetto.dev.
+    Spans may be recorded from several threads, each thread gets its own row in the trace.
+    '''
+
+    def __init__(self, scene: str):
+        self.scene = scene
+        self.cubeSize = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+        self.events = []
+        self.selfTimes = defaultdict(float) # phase name -> time not spent in nested spans
+
+    def _stack(self) -> list:
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def begin(self, name: str, node=None, **args) -> Span:
+        stack = self._stack()
+        if node is None and stack:
+            node = stack[-1].args.get('node', None)
+        elif not node is None and not isinstance(node, str):
+            node = node.label if node.label else node.name
+        args.update(scene=self.scene, cubeSize=self.cubeSize, node=node)
+
+        span = Span(name, args)
+        stack.append(span)
+        span.start = time.perf_counter()
+        return span
+
+    def end(self, span: Span):
+        end = time.perf_counter()
+        duration = end - span.start
+        stack = self._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += duration
+
+        with self.lock:
+            self.selfTimes[span.name] += duration - span.children
+            self.events.append({
+                'name': span.name,
+                'cat': 'export',
+                'ph': 'X',
+                'ts': round((span.start - self.origin) * 1e6, 1),
+                'dur': round(duration * 1e6, 1),
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': {k: v for k, v in span.args.items() if not v is None},
+            })
+
+    def write(self, tracefile: str):
+        with self.lock:
+            events = list(self.events)
+        with open(tracefile, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self) -> str:
+        phases = OrderedDict(sorted(self.selfTimes.items(), key=lambda item: -item[1]))
+        return ", ".join("%s %.2fs" % (name, seconds) for name, seconds in phases.items())
+
+class span:
+    '''Records the enclosed block as a span of the running export, if it is traced.'''
+
+    def __init__(self, name: str, node=None, **args):
+        self.tracer = _tracer
+        self.name = name
+        self.node = node
+        self.args = args
+        self.span = None
+
+    def __enter__(self):
+        if not self.tracer is None:
+            self.span = self.tracer.begin(self.name, self.node, **self.args)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.span is None:
+            self.tracer.end(self.span)
+
+def traced(name: str, isNodeMethod=False):
+    '''
+    Decorates a function so that its calls are recorded as spans while an export is traced.
+    For methods of export-nodes pass isNodeMethod to record the node with the span.
+    Apart from one check the decorated function runs as it is if tracing is off.
+    '''
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return func(*args, **kwargs)
+
+            entry = tracer.begin(name, args[0] if isNodeMethod else None)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                tracer.end(entry)
+        return wrapper
+    return decorate
+
+def start(tracer: Tracer):
+    global _tracer
+    _tracer = tracer
+
+def stop():
+    global _tracer
+    _tracer = None
+
+def current() -> Tracer:
+    return _tracer
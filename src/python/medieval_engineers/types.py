@@ -2,7 +2,6 @@ from collections import OrderedDict
 import re
 import bpy
 import os
-import requests
 from mathutils import Vector
 from .pbr_node_group import firstMatching, createMaterialNodeTree, createDx11ShaderGroup, getDx11Shader, \
     getDx11ShaderGroup
@@ -118,6 +117,45 @@ class MEAddonPreferences(bpy.types.AddonPreferences):
         description='Locate hctStandAloneFilterManager.exe. Probably in C:\\Program Files\\Havok\\HavokContentTools\\',
     )
 
+    max_tool_jobs: bpy.props.IntProperty(
+        name="Parallel Tool Runs", default=1, min=1, max=32,
+        description="How many external tools (Havok, MwmBuilder) may run at the same time during an export. "
+                    "Export-nodes that don't depend on each other are then converted concurrently.",
+    )
+
+    fbx_writer_processes: bpy.props.IntProperty(
+        name="FBX Writer Processes", default=0, min=0, max=32,
+        description="Write .fbx files of meshes and empties in this many background processes, "
+                    "so that the export can go on with the next export-node in the meantime. 0 writes them right away",
+    )
+
+    bake_processes: bpy.props.IntProperty(
+        name="Bake Processes", default=0, min=0, max=32,
+        description="Bake the actions of animated exports in this many background Blender processes "
+                    "if all actions are exported. The .blend file must be saved. 0 or 1 bakes them in Blender itself",
+    )
+
+    use_artifact_cache: bpy.props.BoolProperty(
+        name="Cache Tool Results", default=False,
+        description="Keep the .hkt and .mwm files the external tools produced and reuse them "
+                    "if a later export has exactly the same input",
+    )
+    artifact_cache_dir: bpy.props.StringProperty(
+        name="Cache Directory",
+        subtype='DIR_PATH',
+        description="Where cached tool results are kept. Uses a folder in the system's temporary directory if empty",
+    )
+    artifact_cache_size: bpy.props.IntProperty(
+        name="Cache Size (MB)", default=1024, min=16,
+        description="The least recently used results are removed from the cache once it grows beyond this size",
+    )
+
+    use_tracing: bpy.props.BoolProperty(
+        name="Trace Exports", default=False,
+        description="Record where the time of an export goes. Writes a {BlockPairName}.trace.json next to the "
+                    "exported files that can be opened in chrome://tracing or ui.perfetto.dev",
+    )
+
     def versions_enum(self, context):
         return [info[1] for info in versions.values()]
 
@@ -155,6 +193,18 @@ class MEAddonPreferences(bpy.types.AddonPreferences):
         col.prop(self, 'havokFilterMgr')
         col.alert = False
 
+        col = layout.column()
+        col.label(text="Export", icon="EXPORT")
+        col.prop(self, 'max_tool_jobs')
+        col.prop(self, 'fbx_writer_processes')
+        col.prop(self, 'bake_processes')
+        col.prop(self, 'use_artifact_cache')
+        row = col.row()
+        row.enabled = self.use_artifact_cache
+        row.prop(self, 'artifact_cache_dir')
+        row.prop(self, 'artifact_cache_size')
+        col.prop(self, 'use_tracing')
+
         layout.separator()
 
         split = layout.split(factor=0.42)
@@ -194,6 +244,7 @@ class MECheckVersionOnline(bpy.types.Operator):
 
     def execute(self, context):
         global versions, latestRelease, latestPreRelease
+        import requests
 
         try:
             vers, latestRelease, latestPreRelease = versionsOnGitHub("adamb70", "me-blender")
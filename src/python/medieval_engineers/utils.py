@@ -1,11 +1,13 @@
 from collections import namedtuple
 from enum import IntEnum
-from functools import partial
+from functools import partial, lru_cache
 import hashlib
+from string import Template
 import threading
 from mathutils import Matrix, Vector
 import bpy
 import os
+import shutil
 
 # just give proper axis names to the matrix indices
 X = 0
@@ -318,6 +320,47 @@ def md5sum(filepath):
             md5.update(buf)
     return md5.hexdigest()
 
+_FICLONE = 0x40049409 # linux/fs.h
+
+def _reflink(srcfile, dstfile):
+    try:
+        import fcntl
+    except ImportError: # not available on Windows
+        return False
+
+    try:
+        with open(srcfile, 'rb') as src, open(dstfile, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        shutil.copystat(srcfile, dstfile)
+        return True
+    except OSError:
+        if os.path.exists(dstfile):
+            os.remove(dstfile)
+        return False
+
+def link_or_copy(srcfile, dstfile, allowHardlink=True):
+    """
+    Places the content of srcfile at dstfile without copying the data if the filesystem allows it.
+    Tries a copy-on-write reflink first, then a hardlink and only falls back to a real copy after that.
+    Disallow hardlinks if either file might be modified in place later.
+    """
+    if os.path.exists(dstfile):
+        if os.path.samefile(srcfile, dstfile):
+            return
+        os.remove(dstfile)
+
+    if _reflink(srcfile, dstfile):
+        return
+
+    if allowHardlink:
+        try:
+            os.link(srcfile, dstfile)
+            return
+        except (OSError, NotImplementedError):
+            pass
+
+    shutil.copy2(srcfile, dstfile)
+
 def check_path(path, isDirectory=False, expectedBaseName=None, subpathExists=None, matchExtension=None, emptyOk=True):
     if not path:
         return emptyOk
@@ -339,6 +382,54 @@ def check_path(path, isDirectory=False, expectedBaseName=None, subpathExists=Non
 
     return result
 
+class CompiledTemplate:
+    '''
+    A string.Template that is parsed once. expand() substitutes like Template.safe_substitute(),
+    placeholders without a value are left as they are.
+    '''
+    __slots__ = ('parts',)
+
+    def __init__(self, template: str):
+        parts = [] # literal strings and placeholders as (name, placeholder-text)
+        literal = []
+        pos = 0
+        for m in Template.pattern.finditer(template):
+            literal.append(template[pos:m.start()])
+            pos = m.end()
+            name = m.group('named') or m.group('braced')
+            if not m.group('escaped') is None:
+                literal.append(Template.delimiter)
+            elif name is None:
+                literal.append(m.group())
+            else:
+                parts.append(''.join(literal))
+                parts.append((name, m.group()))
+                literal = []
+        literal.append(template[pos:])
+        parts.append(''.join(literal))
+        self.parts = tuple(p for p in parts if p)
+
+    def expand(self, *mappings) -> str:
+        '''Substitutes each placeholder with the value from the first mapping that has one.'''
+        result = []
+        for part in self.parts:
+            if type(part) is str:
+                result.append(part)
+                continue
+            name, text = part
+            for mapping in mappings:
+                try:
+                    text = str(mapping[name])
+                    break
+                except KeyError:
+                    pass
+            result.append(text)
+        return ''.join(result)
+
+@lru_cache(maxsize=1024)
+def compiledTemplate(template: str) -> CompiledTemplate:
+    return CompiledTemplate(template)
+
 currentSceneHolder = threading.local()
 
 def scene():
@@ -364,6 +455,51 @@ class PinnedScene():
     def __exit__(self, exc_type, exc_val, exc_tb):
         currentSceneHolder.scene = self.previousScene
 
+class ObjectIndex:
+    '''
+    The objects of a scene by layer and group, read in one pass over the scene so that filter-nodes
+    don't each look at every object again. See objectIndex().
+    '''
+    __slots__ = ('scene', 'revision', 'objects', 'layerBits', 'byLayer', '_groups')
+
+    def __init__(self, scene, revision: int):
+        self.scene = scene.name
+        self.revision = revision
+        self.objects = tuple(scene.objects)
+        self.layerBits = {obj: layer_bits(obj.layers) for obj in self.objects}
+        # index 0 is the first layer, like ObjectsSocket.layer
+        self.byLayer = tuple(
+            tuple(obj for obj in self.objects if self.layerBits[obj] & layer_bit(layer))
+            for layer in range(20))
+        self._groups = None
+
+    def inLayers(self, objects, mask: int):
+        '''The objects on any of the layers in mask, all objects of the scene if objects is None.'''
+        if objects is None:
+            objects = self.objects
+        bits = self.layerBits
+        return (obj for obj in objects if ((bits[obj] if obj in bits else layer_bits(obj.layers)) & mask) != 0)
+
+    def groups(self, obj) -> tuple:
+        '''The names of the groups of an object.'''
+        if self._groups is None:
+            self._groups = {o: tuple(g.name for g in o.users_group) for o in self.objects}
+        names = self._groups.get(obj, None)
+        return names if not names is None else tuple(g.name for g in obj.users_group)
+
+_objectIndex = None
+
+def objectIndex() -> ObjectIndex:
+    '''The ObjectIndex of the current scene, it is built again after the scene changed.'''
+    global _objectIndex
+    from .mesh_cache import revision
+
+    s = scene()
+    index = _objectIndex
+    if index is None or index.scene != s.name or index.revision != revision():
+        index = _objectIndex = ObjectIndex(s, revision())
+    return index
+
 currentSettingsHolder = threading.local()
 
 def exportSettings():
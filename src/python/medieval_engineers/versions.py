@@ -1,5 +1,4 @@
 import re
-import requests
 
 class Logger:
     def info(self, msg, **kwargs):
@@ -104,6 +103,8 @@ def versionsOnGitHub(owner: str, repos: str) -> tuple:
 
     :raises: requests.RequestException, ValueError
     """
+    import requests # slow to import, so only when it's needed
+
     tags = requests.get(_GITHUB_RELEASES_URL % (owner, repos), verify=False)
     json = tags.json()
 